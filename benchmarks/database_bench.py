@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+
+# Microlib is a small collection of useful tools.
+# Copyright 2020 Nicolas Hainaux <nh.techn@gmail.com>
+
+# This file is part of Microlib.
+
+# Microlib is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# any later version.
+
+# Microlib is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Microlib; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""
+Benchmarks of microlib.database's hot paths, on synthetic tables.
+
+Run them, and save the results, with:
+
+python -m benchmarks.database_bench --output results.json
+
+and check a later run against these results with:
+
+python -m benchmarks.database_bench --compare results.json
+
+The tables are built in temporary files (or in memory, with --memory), so
+that no network nor existing database is required.
+"""
+
+import sys
+import json
+import time
+import random
+import sqlite3
+import argparse
+import platform
+import tempfile
+from pathlib import Path
+from datetime import datetime
+from contextlib import closing
+
+from microlib import terminal
+from microlib.database import Connection, Ts_Operator
+
+SIZES = [10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6]
+REPEAT = 3
+# A timing is regressed if it is more than TOLERANCE (relatively) slower
+# than the baseline's one
+TOLERANCE = 0.2
+# Number of rows drawn by the draw_rows benchmarks
+DRAWN = 10
+COLS = ['word', 'number']
+
+
+def synthetic_rows(n, seed=0):
+    """Generate n rows of random content."""
+    rng = random.Random(seed)
+    for _ in range(n):
+        yield (''.join(rng.choices('abcdefghijklmnopqrstuvwxyz', k=8)),
+               str(rng.randint(0, 10 ** 6)))
+
+
+def build_template(path, n):
+    """
+    Create the database the benchmarks start from: a table "bench" of n
+    rows, one tenth of them timestamped, and a table "other" of n // 10
+    rows.
+    """
+    with closing(sqlite3.connect(str(path), factory=Connection)) as conn:
+        db = Ts_Operator(conn.cursor())
+        db.create_table('bench', COLS, synthetic_rows(n))
+        db.create_table('other', COLS, synthetic_rows(max(n // 10, 1),
+                                                      seed=1))
+        db._timestamp_ids('bench', list(range(1, n + 1, 10)))
+        conn.commit()
+
+
+def bench_insert_rows(db, n):
+    db.create_table('new', COLS)
+    rows = list(synthetic_rows(n))
+    return lambda: db.insert_rows('new', rows)
+
+
+def bench_get_table(db, n):
+    return lambda: db.get_table('bench')
+
+
+def bench_remove_row(db, n):
+    return lambda: db.remove_row('bench', n // 2)
+
+
+def bench_remove_rows(db, n):
+    step = max(n // 10, 2)
+    span = ','.join(str(i) for i in range(1, n + 1, step))
+    return lambda: db.remove_rows('bench', span)
+
+
+def bench_sort_table(db, n):
+    return lambda: db.sort_table('bench', 1)
+
+
+def bench_copy_table(db, n):
+    return lambda: db.copy_table('bench', 'copy')
+
+
+def bench_merge_tables(db, n):
+    return lambda: db.merge_tables('other', 'bench')
+
+
+def bench_draw_rows(db, n):
+    return lambda: db.draw_rows('bench', min(DRAWN, n), seed=1)
+
+
+def bench_draw_rows_oldest_prevail(db, n):
+    return lambda: db.draw_rows('bench', min(DRAWN, n), oldest_prevail=True,
+                                seed=1)
+
+
+def bench_reset(db, n):
+    return lambda: db._reset('bench', max(n // 20, 1))
+
+
+BENCHMARKS = {name[len('bench_'):]: function
+              for name, function in globals().items()
+              if name.startswith('bench_')}
+
+
+def time_benchmark(template, name, n, repeat=REPEAT, memory=False):
+    """
+    Run the benchmark name repeat times, each time on a fresh copy of the
+    template database, and return the best timing (in seconds).
+    """
+    timings = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for i in range(repeat):
+            path = ':memory:' if memory else Path(tmpdir) / f'{i}.db'
+            conn = sqlite3.connect(str(path), factory=Connection)
+            try:
+                with closing(sqlite3.connect(str(template))) as source:
+                    source.backup(conn)
+                run = BENCHMARKS[name](Ts_Operator(conn.cursor()), n)
+                start = time.perf_counter()
+                run()
+                conn.commit()
+                timings.append(time.perf_counter() - start)
+            finally:
+                conn.close()
+    return min(timings)
+
+
+def run(sizes=None, names=None, repeat=REPEAT, memory=False, verbose=False):
+    """
+    Run the benchmarks (all of them by default) for each size and return
+    the results, as a dict ready to be dumped as JSON.
+    """
+    sizes = sizes or SIZES
+    names = names or list(BENCHMARKS)
+    timings = {name: {} for name in names}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for n in sizes:
+            template = Path(tmpdir) / f'template_{n}.db'
+            build_template(template, n)
+            for name in names:
+                timing = time_benchmark(template, name, n, repeat=repeat,
+                                        memory=memory)
+                timings[name][str(n)] = timing
+                if verbose:
+                    print(f'{name} ({n} rows): {timing * 1000:.3f} ms')
+    return {'meta': {'date': datetime.now().isoformat(timespec='seconds'),
+                     'python': platform.python_version(),
+                     'sqlite': sqlite3.sqlite_version,
+                     'repeat': repeat, 'memory': memory},
+            'timings': timings}
+
+
+def compare(results, baseline, tolerance=TOLERANCE):
+    """
+    Compare the timings of results to the ones of baseline.
+
+    Return a list of (name, size, baseline's timing, timing, ratio,
+    regressed) tuples, for the benchmarks found in both.
+    """
+    comparison = []
+    for name, timings in results['timings'].items():
+        for size, timing in timings.items():
+            old = baseline['timings'].get(name, {}).get(size)
+            if old is None:
+                continue
+            ratio = timing / old if old else float('inf')
+            comparison.append((name, size, old, timing, ratio,
+                               ratio > 1 + tolerance))
+    return comparison
+
+
+def comparison_to_text(comparison):
+    """Return the comparison as a text table."""
+    rows = [['benchmark', 'rows', 'baseline ms', 'ms', 'ratio', '']]
+    rows += [[name, size, f'{old * 1000:.3f}', f'{new * 1000:.3f}',
+              f'{ratio:.2f}', 'REGRESSED' if regressed else '']
+             for name, size, old, new, ratio, regressed in comparison]
+    return terminal.tabulate(rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmark microlib.database on synthetic tables.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES,
+                        help='numbers of rows of the tables')
+    parser.add_argument('--only', nargs='+', choices=list(BENCHMARKS),
+                        help='run only these benchmarks')
+    parser.add_argument('--repeat', type=int, default=REPEAT,
+                        help='number of runs of each benchmark (the best '
+                        'timing is kept)')
+    parser.add_argument('--memory', action='store_true',
+                        help='use in-memory databases instead of temporary '
+                        'files')
+    parser.add_argument('--output', type=Path,
+                        help='JSON file to write the results to')
+    parser.add_argument('--compare', type=Path,
+                        help='JSON file of previous results to compare to')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE,
+                        help='relative slowdown above which a timing is '
+                        'regressed')
+    args = parser.parse_args(argv)
+    results = run(sizes=args.sizes, names=args.only, repeat=args.repeat,
+                  memory=args.memory, verbose=True)
+    if args.output is not None:
+        args.output.write_text(json.dumps(results, indent=2))
+    if args.compare is not None:
+        baseline = json.loads(args.compare.read_text())
+        comparison = compare(results, baseline, tolerance=args.tolerance)
+        print(comparison_to_text(comparison))
+        if any(regressed for *_, regressed in comparison):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
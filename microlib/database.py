@@ -19,12 +19,70 @@
 # along with Microlib; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
 
+import io
+import re
+import csv
+import gzip
+import json
+import math
+import time
+import queue
+import random
 import sqlite3
+import asyncio
+import itertools
+import threading
+import functools
+import dataclasses
+from typing import get_type_hints
+from array import array
+from collections.abc import Iterator
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from collections import OrderedDict
+from contextlib import contextmanager, closing
+from datetime import datetime, timezone
 
 from intspan import intspan
 
 from microlib import terminal
 
+# Largest possible value of an INTEGER PRIMARY KEY
+MAX_ID = 2 ** 63 - 1
+# Number of (first, last) ids' ranges checked in a single query
+RANGES_CHUNK = 400
+# Number of ids looked for in a single query
+IDS_CHUNK = 500
+# When randomly drawing rows, if less than one id out of SPARSE_RATIO is a
+# candidate, or if less than SPARSE_RATIO candidates per drawn row are
+# available, all candidates are read, instead of trying random ids
+SPARSE_RATIO = 4
+# Default number of rows fetched at a time when iterating over results
+BATCH_SIZE = 1000
+# Prefix of the tables used by microlib for its own bookkeeping (they do not
+# show up in Operator.list_tables())
+INTERNAL_PREFIX = '_microlib_'
+# Table storing the generation counters of Ts_Operator tables
+GENERATIONS_TABLE = f'{INTERNAL_PREFIX}generations'
+# Table listing the Ts_Operator tables whose timestamps are integers
+INT_TIMESTAMPS_TABLE = f'{INTERNAL_PREFIX}int_timestamps'
+# Table storing the rows' counters of the tables having counters enabled
+COUNTERS_TABLE = f'{INTERNAL_PREFIX}counters'
+# SQL types of the columns matching the fields of dataclasses
+PYTHON_TYPES = {int: 'INTEGER', float: 'REAL', str: 'TEXT', bytes: 'BLOB',
+                bool: 'INTEGER'}
+# Oldest SQLite version supporting STRICT tables
+STRICT_TABLES_VERSION = (3, 37, 0)
+# Formats of the files tables can be exported to, or imported from
+FORMATS = ('csv', 'jsonl')
+# Pragmas that can be set when opening a connection
+PRAGMAS = ('journal_mode', 'synchronous', 'cache_size', 'mmap_size',
+           'temp_store', 'busy_timeout')
+# A profile suitable for most read-heavy, multi-connections usages
+PERFORMANCE_PRAGMAS = {'journal_mode': 'WAL', 'synchronous': 'NORMAL',
+                       'cache_size': -64000, 'mmap_size': 268435456,
+                       'temp_store': 'MEMORY', 'busy_timeout': 5000}
+
 
 def intspan2sqllist(s):
     """Turn an ints' span (given as str) to a SQLite list of values."""
@@ -32,6 +90,695 @@ def intspan2sqllist(s):
     return f'({values})'
 
 
+def int_id(id_):
+    """
+    Return id_ as an int (ids may be given as str, like get_table() returns
+    them).
+    """
+    try:
+        return int(id_)
+    except (TypeError, ValueError):
+        raise ValueError(f'In database, cannot use "{id_}" as an id (ids '
+                         f'are integers).')
+
+
+def reservoir_sample(items, n, rng=random):
+    """
+    Randomly choose n items from the items iterable, in one pass and
+    keeping only n items in memory (Li's "Algorithm L").
+
+    The chosen items are returned in random order. If there are less than n
+    items, all of them are returned.
+    """
+    items = iter(items)
+    sample = list(itertools.islice(items, n))
+    if len(sample) == n and n:
+        w = math.exp(math.log(_random_open(rng)) / n)
+        while True:
+            skip = math.floor(math.log(_random_open(rng))
+                              / math.log(1 - w))
+            item = next(itertools.islice(items, skip, None), None)
+            if item is None:
+                break
+            sample[rng.randrange(n)] = item
+            w *= math.exp(math.log(_random_open(rng)) / n)
+    rng.shuffle(sample)
+    return sample
+
+
+def dataclass_columns(cls):
+    """
+    Return the columns' titles and SQL types (as a dict) matching the fields
+    of a dataclass. Fields whose type is not in PYTHON_TYPES are turned to
+    TEXT columns.
+    """
+    hints = get_type_hints(cls)
+    titles = [field.name for field in dataclasses.fields(cls)]
+    return (titles, {title: PYTHON_TYPES.get(hints.get(title), 'TEXT')
+                     for title in titles})
+
+
+def rename_index_sql(sql, new_name, new_table=None):
+    """
+    Change the index' name (and possibly the table's name) in the sql
+    statement that creates it.
+    """
+    name = r'(`[^`]+`|"[^"]+"|\[[^\]]+\]|[^\s(]+)'
+    match = re.search(rf'INDEX\s+(IF\s+NOT\s+EXISTS\s+)?{name}\s+ON\s+{name}',
+                      sql, flags=re.I)
+    table = match.group(3) if new_table is None else f'`{new_table}`'
+    return f'{sql[:match.start()]}INDEX `{new_name}` ON {table}'\
+        f'{sql[match.end():]}'
+
+
+@contextmanager
+def _text_file(fileobj, mode, compress):
+    """
+    Yield fileobj, or, if compress is True, a text file (de)compressing its
+    content from, or to, fileobj (that must then be a binary file). fileobj
+    is left open.
+    """
+    if not compress:
+        yield fileobj
+        return
+    with gzip.GzipFile(fileobj=fileobj, mode=mode + 'b') as zipped:
+        text = io.TextIOWrapper(zipped, encoding='utf-8', newline='')
+        try:
+            yield text
+        finally:
+            if mode == 'w':
+                text.flush()
+            text.detach()
+
+
+def _check_format(fmt):
+    if fmt not in FORMATS:
+        raise ValueError(f'In database, cannot use the format "{fmt}" '
+                         f'(only {", ".join(FORMATS)} are available).')
+
+
+def _get_rng(seed=None, rng=None):
+    """
+    Return rng if provided, a random.Random instance seeded with seed if
+    provided, the random module itself otherwise.
+    """
+    if rng is not None:
+        return rng
+    if seed is not None:
+        return random.Random(seed)
+    return random
+
+
+def _random_open(rng):
+    """Return a random float from the open interval (0, 1)."""
+    x = 0.0
+    while not x:
+        x = rng.random()
+    return x
+
+
+class SchemaCache:
+    """
+    Tables' names, columns and indexes of a database, kept as long as its
+    schema does not change.
+
+    The cache is checked against PRAGMA schema_version before each use, so
+    that changes made by other connections (or behind the Operator's back)
+    are taken into account. It is also explicitly invalidated by the
+    Operator methods that change the schema, and by rollbacks (that set
+    schema_version back, so that a later change could bring it to the
+    cached value again).
+    """
+    def __init__(self):
+        self.version = None
+        self.clear()
+
+    def clear(self):
+        """Forget everything."""
+        self.tables = None
+        self.columns = {}
+        self.indexes = {}
+
+    def invalidate(self):
+        """Forget everything, including the schema version."""
+        self.clear()
+        self.version = None
+
+
+class ResultCache:
+    """
+    Results of the Operator's read methods, kept as long as the database's
+    content does not change.
+
+    At most maxsize results are kept, the least recently used ones being
+    discarded first. The cache is checked before each use against a token
+    made of PRAGMA data_version and PRAGMA schema_version (that change when
+    other connections commit changes) and of the number of rows changed by
+    the connection itself.
+    """
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.token = None
+        self.results = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def clear(self):
+        """Forget everything."""
+        self.token = None
+        self.results.clear()
+
+    def check(self, token):
+        """Clear the cache if token differs from the one of its results."""
+        if token != self.token:
+            self.results.clear()
+            self.token = token
+
+    def get(self, key):
+        """Return the result stored under key (None if there is none)."""
+        result = self.results.get(key)
+        if result is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.results.move_to_end(key)
+        return result
+
+    def store(self, key, result):
+        """Store result under key, discarding the oldest one if necessary."""
+        self.results[key] = result
+        if len(self.results) > self.maxsize:
+            self.results.popitem(last=False)
+
+
+def _hashable(value):
+    """Turn lists (e.g. of columns) into tuples, so that value is hashable."""
+    return tuple(value) if isinstance(value, list) else value
+
+
+def cached(method):
+    """
+    Make an Operator's read method use the Operator's result cache, if it
+    has one.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self.result_cache is None:
+            return method(self, *args, **kwargs)
+        self.result_cache.check(self._data_token())
+        key = (method.__name__, tuple(_hashable(a) for a in args),
+               tuple(sorted((k, _hashable(v)) for k, v in kwargs.items())))
+        result = self.result_cache.get(key)
+        if result is None:
+            result = method(self, *args, **kwargs)
+            self.result_cache.store(key, result)
+        # Lists are copied, so that callers may modify them safely
+        return list(result) if isinstance(result, list) else result
+    return wrapper
+
+
+def statement_template(sql):
+    """
+    Return sql with its literal values replaced by ? and its whitespaces
+    collapsed, so that the executions of a same statement can be grouped.
+    """
+    sql = re.sub(r"'(?:[^']|'')*'", '?', sql)
+    sql = re.sub(r'\b\d+(?:\.\d+)?\b', '?', sql)
+    sql = re.sub(r'\?(?:\s*,\s*\?)+', '?, ...', sql)
+    return re.sub(r'\s+', ' ', sql).strip().rstrip(';')
+
+
+class StatementStats:
+    """Execution statistics of a statement (or of a group of statements)."""
+    def __init__(self):
+        self.executions = 0
+        self.calls = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.rows = 0
+        # Number of calls per duration's upper bound (in microseconds, a
+        # power of 2)
+        self.histogram = {}
+
+    def record(self, duration, rows):
+        """Take a call into account."""
+        self.calls += 1
+        self.total_time += duration
+        self.max_time = max(self.max_time, duration)
+        self.rows += max(rows, 0)
+        bound = 1 << int(duration * 1000000).bit_length()
+        self.histogram[bound] = self.histogram.get(bound, 0) + 1
+
+
+class Instrumentation:
+    """
+    Statistics about the statements run on a connection.
+
+    Each statement run by SQLite (each execution of an executemany()
+    included) is counted, through the connection's trace callback (a
+    statement firing triggers is reported, hence counted, again for each
+    trigger's program run). The calls to execute() and executemany()
+    are timed (the time spent fetching the rows afterwards is not) and the
+    number of rows they modify is added up. Statements are grouped by
+    template (see statement_template()) and by operation (SELECT, INSERT,
+    PRAGMA...).
+
+    The calls lasting longer than slow_threshold (in seconds) are kept in
+    slow_queries, along with their EXPLAIN QUERY PLAN if explain is True.
+
+    Pass it to a ContextManager to instrument the connection it opens:
+
+    cm = ContextManager(PATH_TO_DB, instrumentation=Instrumentation())
+    with cm as cursor:
+        ...
+    print(cm.report)
+    """
+    def __init__(self, slow_threshold=None, explain=False):
+        self.slow_threshold = slow_threshold
+        self.explain = explain
+        self.statements = {}
+        self.operations = {}
+        self.slow_queries = []
+        self.connection = None
+        self._explaining = False
+
+    def attach(self, conn):
+        """Start instrumenting conn (that must be a microlib Connection)."""
+        self.connection = conn
+        conn.instrumentation = self
+        conn.set_trace_callback(self._trace)
+
+    def detach(self):
+        """Stop instrumenting the connection."""
+        if self.connection is not None:
+            self.connection.set_trace_callback(None)
+            self.connection.instrumentation = None
+            self.connection = None
+
+    def _stats(self, sql):
+        """Return the statistics of sql's template and operation."""
+        template = statement_template(sql)
+        if template not in self.statements:
+            self.statements[template] = StatementStats()
+        operation = template.lstrip('- ').split(' ', 1)[0].upper()
+        if operation not in self.operations:
+            self.operations[operation] = StatementStats()
+        return (self.statements[template], self.operations[operation])
+
+    def _trace(self, sql):
+        if not self._explaining:
+            for stats in self._stats(sql):
+                stats.executions += 1
+
+    def record(self, sql, params, duration, rows):
+        """Take into account a call to execute() or executemany()."""
+        for stats in self._stats(sql):
+            stats.record(duration, rows)
+        if self.slow_threshold is not None \
+                and duration >= self.slow_threshold:
+            plan = None
+            if self.explain and params is not None:
+                plan = self._query_plan(sql, params)
+            self.slow_queries.append((duration, sql, plan))
+
+    def _query_plan(self, sql, params):
+        """Return the EXPLAIN QUERY PLAN of sql (None if there is none)."""
+        if sql.lstrip().split(' ', 1)[0].upper() \
+                not in ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH'):
+            return None
+        self._explaining = True
+        try:
+            rows = sqlite3.Cursor(self.connection)\
+                .execute(f'EXPLAIN QUERY PLAN {sql}', params).fetchall()
+        except sqlite3.Error:
+            return None
+        finally:
+            self._explaining = False
+        return [row[-1] for row in rows]
+
+    def report(self, limit=20):
+        """
+        Return a text report of the statistics: the operations, then the
+        limit statements taking the most time, then the slow ones.
+        """
+        def ms(duration):
+            return f'{duration * 1000:.3f}'
+
+        def histogram(stats):
+            return ', '.join(f'<{bound}µs: {n}' for bound, n
+                             in sorted(stats.histogram.items()))
+
+        headers = ['executions', 'calls', 'total ms', 'max ms', 'rows']
+
+        def row(title, stats):
+            return [title, str(stats.executions), str(stats.calls),
+                    ms(stats.total_time), ms(stats.max_time), str(stats.rows)]
+
+        operations = sorted(self.operations.items(),
+                            key=lambda item: -item[1].total_time)
+        statements = sorted(self.statements.items(),
+                            key=lambda item: -item[1].total_time)[:limit]
+        report = [terminal.tabulate([['operation'] + headers]
+                                    + [row(*item) for item in operations]),
+                  '', 'Latencies:']
+        report += [f'{operation}: {histogram(stats)}'
+                   for operation, stats in operations if stats.calls]
+        report += ['', terminal.tabulate([['statement'] + headers]
+                                         + [row(*item)
+                                            for item in statements])]
+        if self.slow_queries:
+            report += ['', 'Slow statements:']
+            for duration, sql, plan in self.slow_queries:
+                report.append(f'{ms(duration)} ms: {sql}')
+                report += [f'    {detail}' for detail in plan or []]
+        return '\n'.join(report)
+
+
+class Cursor(sqlite3.Cursor):
+    """
+    sqlite3 cursor whose calls to execute() and executemany() are recorded
+    by the Instrumentation of its connection.
+    """
+    def execute(self, sql, parameters=()):
+        instrumentation = self.connection.instrumentation
+        if instrumentation is None:
+            return super().execute(sql, parameters)
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            instrumentation.record(sql, parameters,
+                                   time.perf_counter() - start, self.rowcount)
+
+    def executemany(self, sql, seq_of_parameters):
+        instrumentation = self.connection.instrumentation
+        if instrumentation is None:
+            return super().executemany(sql, seq_of_parameters)
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            instrumentation.record(sql, None, time.perf_counter() - start,
+                                   self.rowcount)
+
+
+class Connection(sqlite3.Connection):
+    """
+    sqlite3 connection that carries microlib's per-connection caches.
+
+    All Operators working on a cursor of such a connection share the same
+    caches. Operators working on a cursor of a plain sqlite3 connection
+    use caches of their own.
+
+    If an Instrumentation is attached to the connection, its cursors are
+    instrumented ones.
+
+    savepoints lists the savepoints opened by microlib (and not released
+    yet) on the connection.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.schema_cache = SchemaCache()
+        self.instrumentation = None
+        self.replica = None
+        self.retry_policy = None
+        self.savepoints = []
+
+    def commit(self):
+        super().commit()
+        if self.replica is not None:
+            self.replica.committed()
+
+    def rollback(self):
+        try:
+            super().rollback()
+        finally:
+            self.schema_cache.invalidate()
+
+    def cursor(self, factory=None):
+        if factory is None:
+            factory = sqlite3.Cursor if self.instrumentation is None \
+                else Cursor
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        if self.instrumentation is None:
+            return super().execute(sql, parameters)
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        if self.instrumentation is None:
+            return super().executemany(sql, seq_of_parameters)
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+def connect(path, pragmas=None, **kwargs):
+    """
+    Open a microlib Connection to the database at path.
+
+    pragmas is a dict of pragmas (taken from PRAGMAS) to set, like
+    PERFORMANCE_PRAGMAS. Other keyword arguments are passed to
+    sqlite3.connect().
+    """
+    conn = sqlite3.connect(str(path), factory=Connection, **kwargs)
+    for name, value in (pragmas or {}).items():
+        if name not in PRAGMAS:
+            raise ValueError(f'In database, cannot set pragma "{name}" '
+                             f'(only {", ".join(PRAGMAS)} can be set).')
+        if not str(value).lstrip('-').isalnum():
+            raise ValueError(f'In database, invalid value "{value}" for '
+                             f'pragma "{name}".')
+        conn.execute(f'PRAGMA {name}={value};')
+    return conn
+
+
+class ConnectionPool:
+    """
+    Keep connections open in order to reuse them, one per path and thread.
+
+    Pass it to several ContextManagers to avoid paying for the connection
+    setup and the page cache warm-up at each one of them:
+
+    pool = ConnectionPool()
+    with ContextManager(PATH_TO_DB, pool=pool) as cursor:
+        ...
+
+    Note that a ':memory:' database then lives as long as the pool keeps
+    its connection, instead of vanishing at the end of each with block.
+    """
+    def __init__(self):
+        self.connections = {}
+        self.lock = threading.Lock()
+
+    def connection(self, path, pragmas=None):
+        """
+        Return the connection to path of the current thread, opening it
+        (and setting pragmas) if necessary.
+        """
+        key = (str(path), threading.get_ident())
+        with self.lock:
+            conn = self.connections.get(key)
+        if conn is None:
+            # The connections are only used by their own thread, but they
+            # can be closed by any thread
+            conn = connect(path, pragmas=pragmas, check_same_thread=False)
+            with self.lock:
+                self.connections[key] = conn
+        return conn
+
+    def discard(self, path, conn):
+        """Forget conn (the connection to path of the current thread)."""
+        key = (str(path), threading.get_ident())
+        with self.lock:
+            if self.connections.get(key) is conn:
+                del self.connections[key]
+
+    def close(self):
+        """Close all connections."""
+        with self.lock:
+            connections = list(self.connections.values())
+            self.connections = {}
+        for conn in connections:
+            conn.close()
+
+
+class TemplateCache:
+    """
+    In-memory copies of database files, each one read once, to quickly
+    create fresh in-memory databases having the same content.
+
+    A copy is never read again from its file: if the file changes, clear()
+    the cache.
+    """
+    def __init__(self):
+        self.templates = {}
+        self.lock = threading.Lock()
+
+    def copy(self, path, conn):
+        """Copy the database at path into conn."""
+        key = str(Path(path).resolve())
+        with self.lock:
+            template = self.templates.get(key)
+            if template is None:
+                template = sqlite3.connect(':memory:',
+                                           check_same_thread=False)
+                with closing(sqlite3.connect(key)) as source:
+                    source.backup(template)
+                self.templates[key] = template
+            template.backup(conn)
+
+    def clear(self):
+        """Forget all templates."""
+        with self.lock:
+            templates = list(self.templates.values())
+            self.templates = {}
+        for template in templates:
+            template.close()
+
+
+# Templates of the in-memory databases used in testing mode
+TEMPLATES = TemplateCache()
+
+
+class MemoryReplica:
+    """
+    In-memory copy of a database file, written back to the file at commit.
+
+    open() copies the file into a ':memory:' connection (through the
+    backup API), on which all reads and writes then run. Each commit of
+    this connection writes the database back to the file, unless the
+    previous write-back happened less than flush_interval seconds ago. In
+    any case, close() writes back the changes not written yet. Nothing is
+    written back if the database has not changed since the last write-back,
+    nor ever if write_back is False.
+
+    If template is True, the content is copied from the TEMPLATES cache
+    instead of the file, that is then read only the first time.
+    """
+    def __init__(self, path, flush_interval=0, pragmas=None, write_back=True,
+                 template=False):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.write_back = write_back
+        self.template = template
+        self.pragmas = pragmas
+        self.connection = None
+        self.flushes = 0
+        self._flushed = None
+        self._last_flush = None
+
+    def _state(self):
+        """Return a value that changes whenever the database changes."""
+        version = self.connection.execute('PRAGMA schema_version;')\
+            .fetchone()[0]
+        return (self.connection.total_changes, version)
+
+    def open(self):
+        """Copy the database file in memory and return the connection."""
+        self.connection = connect(':memory:', pragmas=self.pragmas)
+        if self.template:
+            TEMPLATES.copy(self.path, self.connection)
+        else:
+            with closing(sqlite3.connect(str(self.path))) as source:
+                source.backup(self.connection)
+        self.connection.replica = self
+        self._flushed = self._state()
+        self._last_flush = time.monotonic()
+        return self.connection
+
+    def flush(self):
+        """
+        Write the database back to the file, if it has changed. Return True
+        if it has been written.
+        """
+        state = self._state()
+        if not self.write_back or state == self._flushed:
+            return False
+        with closing(sqlite3.connect(str(self.path))) as target:
+            self.connection.backup(target)
+        self._flushed = state
+        self._last_flush = time.monotonic()
+        self.flushes += 1
+        return True
+
+    def committed(self):
+        """Flush, unless the last flush is too recent."""
+        if time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def close(self):
+        """Close the connection, after writing back the changes."""
+        self.flush()
+        self.connection.replica = None
+        self.connection.close()
+
+
+def is_lock_error(exc):
+    """True if exc is raised because the database is locked (or busy)."""
+    return isinstance(exc, sqlite3.OperationalError) \
+        and ('locked' in str(exc) or 'busy' in str(exc))
+
+
+class RetryPolicy:
+    """
+    How to retry the operations failing because the database is locked by
+    another connection.
+
+    SQLite itself waits up to busy_timeout milliseconds for a lock to be
+    released. If the operation still fails, it is run again, up to attempts
+    times in all, after waiting base_delay seconds, then twice as long
+    before each next attempt (but never more than max_delay). Each wait is
+    randomly shortened by up to jitter (a ratio), so that the waiting
+    connections do not all retry at the same time.
+
+    The retries are counted in the metrics, that can be shared by several
+    ContextManagers using the same RetryPolicy.
+    """
+    def __init__(self, attempts=5, base_delay=0.01, max_delay=1.0,
+                 jitter=0.5, busy_timeout=5000, seed=None):
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.busy_timeout = busy_timeout
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.metrics = {'lock_errors': 0, 'retries': 0, 'wait_time': 0.0,
+                        'failures': 0}
+
+    def delay(self, attempt):
+        """Return the time to wait before the attempt number attempt + 1."""
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        return delay * (1 - self.jitter * self.rng.random())
+
+    def _count(self, **increments):
+        with self.lock:
+            for name, increment in increments.items():
+                self.metrics[name] += increment
+
+    def run(self, function, *args, on_retry=None, **kwargs):
+        """
+        Run function(*args, **kwargs) and return its result, retrying it
+        as long as it fails because the database is locked. on_retry, if
+        given, is called before each retry (to rollback, for instance).
+        """
+        for attempt in range(1, self.attempts + 1):
+            try:
+                return function(*args, **kwargs)
+            except sqlite3.OperationalError as exc:
+                if not is_lock_error(exc):
+                    raise
+                self._count(lock_errors=1)
+                if attempt == self.attempts:
+                    self._count(failures=1)
+                    raise
+            delay = self.delay(attempt)
+            time.sleep(delay)
+            self._count(retries=1, wait_time=delay)
+            if on_retry is not None:
+                on_retry()
+
+
 # Inspiration from: https://gist.github.com/miku/6522074
 class ContextManager:
     """
@@ -53,27 +800,147 @@ class ContextManager:
         with ContextManager(TESTDB_PATH, testing=True) as cursor:
             # and, for instance:
             db = Operator(cursor)
+
+    If a ConnectionPool is given, the connection is taken from it and left
+    open at exit (only the cursor is closed). pragmas are set when the
+    connection is opened (see connect()).
+
+    If instrumentation is True, or an Instrumentation, the statements run
+    on the connection are instrumented, and the report is available as the
+    report attribute after exit.
+
+    If in_memory is True, the database is copied in memory at enter, and
+    the changes are written back to the file at commit (see MemoryReplica;
+    flush_interval is passed to it), so that reads do not depend on disk
+    I/O. This is not compatible with a pool.
+
+    Along with testing, in_memory makes the Manager work on a fresh
+    in-memory copy of the database, taken from the TEMPLATES cache: the
+    file is only read the first time, and nothing is ever written to it.
+    This is much faster in test suites:
+
+    def test_my_stuff():
+        with ContextManager(TESTDB_PATH, testing=True, in_memory=True) \\
+                as cursor:
+            db = Operator(cursor)
+
+    If retry is True, or a RetryPolicy, the connection's busy timeout is
+    set after the policy, and the final commit, as well as the Operators'
+    commands run outside of a transaction, are retried when the database
+    is locked (the Operators' methods running several commands start their
+    transaction by a retried BEGIN IMMEDIATE). If immediate is True, a
+    write transaction is started at enter (BEGIN IMMEDIATE, retried too),
+    so that no other connection may write until exit, and the commands
+    cannot fail because of a lock.
     """
-    def __init__(self, path, testing=False):
+    def __init__(self, path, testing=False, pool=None, pragmas=None,
+                 instrumentation=None, in_memory=False, flush_interval=0,
+                 retry=None, immediate=False):
+        if in_memory and pool is not None:
+            raise ValueError('In database, cannot use a pool of connections '
+                             'along with an in-memory copy of the database.')
         self.path = path
         self.conn = None
         self.cursor = None
         self.testing = testing
+        self.pool = pool
+        self.pragmas = pragmas
+        if instrumentation is True:
+            instrumentation = Instrumentation()
+        self.instrumentation = instrumentation or None
+        self.report = None
+        self.replica = None
+        if in_memory:
+            self.replica = MemoryReplica(path, flush_interval=flush_interval,
+                                         pragmas=pragmas,
+                                         write_back=not testing,
+                                         template=testing)
+        if retry is True:
+            retry = RetryPolicy()
+        self.retry = retry or None
+        self.immediate = immediate
+
+    def _run(self, function, *args):
+        """Run function(*args), retrying it according to the policy."""
+        if self.retry is None:
+            return function(*args)
+        return self.retry.run(function, *args)
 
     def __enter__(self):
-        self.conn = sqlite3.connect(str(self.path))
+        if self.replica is not None:
+            self.conn = self.replica.open()
+        elif self.pool is None:
+            self.conn = connect(self.path, pragmas=self.pragmas)
+        else:
+            self.conn = self.pool.connection(self.path, pragmas=self.pragmas)
+        if self.instrumentation is not None:
+            self.instrumentation.attach(self.conn)
+        if self.retry is not None:
+            self.conn.execute(f'PRAGMA busy_timeout='
+                              f'{int(self.retry.busy_timeout)};')
+            self.conn.retry_policy = self.retry
+        if self.immediate and not self.conn.in_transaction:
+            try:
+                self._run(self.conn.execute, 'BEGIN IMMEDIATE;')
+            except sqlite3.Error:
+                self.conn.retry_policy = None
+                if self.instrumentation is not None:
+                    self.instrumentation.detach()
+                if self.replica is not None:
+                    self.replica.close()
+                elif self.pool is None:
+                    self.conn.close()
+                raise
         self.cursor = self.conn.cursor()
-        if self.testing:
+        # (An in-memory copy is simply discarded at exit)
+        if self.testing and self.replica is None:
             self.cursor.execute('SAVEPOINT starttest;')
+            self.conn.savepoints.append('starttest')
         return self.cursor
 
     def __exit__(self, exc_class, exc, traceback):
-        if self.testing:
-            self.conn.execute('ROLLBACK TO SAVEPOINT starttest;')
-        else:
-            self.conn.commit()
+        failed = True
+        try:
+            if self.testing and self.replica is not None:
+                pass
+            elif self.testing:
+                self.conn.execute('ROLLBACK TO SAVEPOINT starttest;')
+                # Leave no transaction open (matters if the connection is
+                # reused)
+                self.conn.rollback()
+            else:
+                self._run(self.conn.commit)
+            failed = False
+        finally:
+            self._close(failed)
+
+    def _close(self, failed):
+        """
+        Release the cursor and the connection. If failed (the commit, or the
+        rollback, failed), the connection's transaction is rolled back and
+        the connection is closed, even if it belongs to the pool.
+        """
+        self.conn.retry_policy = None
+        if self.testing and self.replica is None:
+            self.conn.savepoints.remove('starttest')
+        if failed:
+            try:
+                self.conn.rollback()
+            except sqlite3.Error:
+                pass
         self.cursor.close()
-        self.conn.close()
+        if self.instrumentation is not None:
+            self.instrumentation.detach()
+            self.report = self.instrumentation.report()
+        if self.replica is not None:
+            if failed:
+                self.replica.write_back = False
+            self.replica.close()
+        elif self.pool is None:
+            self.conn.close()
+        elif failed:
+            self.pool.discard(self.path, self.conn)
+            self.conn.close()
 
 
 class Operator:
@@ -85,15 +952,65 @@ class Operator:
     with microlib.database.Manager(PATH_TO_DB) as cursor:
         mydb = microlib.database.Operator(cursor)
 
+    If cache_size is given, the results of get_table(), get_rows() and
+    get_rows_nb() are cached (up to cache_size of them) until the database
+    changes. Changes made by other connections, or by this one, are
+    detected, but a rollback run directly on the connection is not: call
+    clear_cache() after it.
+
+    If counters is True, the tables are created with counters enabled (see
+    enable_counters()).
     """
-    def __init__(self, cursor):
+    def __init__(self, cursor, cache_size=0, counters=False):
         self.cursor = cursor
+        self.schema_cache = getattr(cursor.connection, 'schema_cache', None)
+        if self.schema_cache is None:
+            self.schema_cache = SchemaCache()
+        self.result_cache = ResultCache(cache_size) if cache_size else None
+        self.counters = counters
+
+    def _data_token(self):
+        """
+        Return a value that changes whenever the database's content or
+        schema changes.
+        """
+        conn = self.cursor.connection
+        versions = conn.execute('SELECT data_version, schema_version '
+                                'FROM pragma_data_version, '
+                                'pragma_schema_version;').fetchone()
+        return versions + (conn.total_changes, )
+
+    def clear_cache(self):
+        """Forget all cached results."""
+        if self.result_cache is not None:
+            self.result_cache.clear()
+
+    def _schema(self):
+        """Return the schema cache, cleared if the schema has changed."""
+        conn = self.cursor.connection
+        version = conn.execute('PRAGMA schema_version;').fetchone()[0]
+        if version != self.schema_cache.version:
+            self.schema_cache.clear()
+            self.schema_cache.version = version
+        return self.schema_cache
+
+    def _invalidate_schema(self):
+        """Clear the schema cache (to be called after any schema change)."""
+        self.schema_cache.invalidate()
+
+    def _all_tables(self):
+        """List all tables, including microlib's internal ones."""
+        schema = self._schema()
+        if schema.tables is None:
+            results = self.cursor.connection.execute(
+                'SELECT name FROM sqlite_master WHERE type=\'table\';')
+            schema.tables = [_[0] for _ in results.fetchall()]
+        return schema.tables
 
     def list_tables(self):
         """List all available tables."""
-        results = self.cursor.execute(
-            'SELECT name FROM sqlite_master WHERE type=\'table\';')
-        return [_[0] for _ in results.fetchall()]
+        return [name for name in self._all_tables()
+                if not name.startswith(INTERNAL_PREFIX)]
 
     def table_exists(self, name):
         """True if a table of this name does exist in the database."""
@@ -115,41 +1032,158 @@ class Operator:
                              f'{id_} in table "{table_name}"')
         return True
 
-    def _exec(self, table_name, cmd, id_=None):
+    def _first_missing_id(self, table_name, first, last):
+        """Return the first id of first..last missing in the table, if any."""
+        if not self.cursor.execute(f'SELECT EXISTS(SELECT 1 FROM {table_name} '
+                                   f'WHERE id=?);', (first, )).fetchone()[0]:
+            return first
+        cmd = f'SELECT MIN(id) + 1 FROM {table_name} AS t1 '\
+            f'WHERE id BETWEEN ? AND ? AND NOT EXISTS('\
+            f'SELECT 1 FROM {table_name} AS t2 WHERE t2.id = t1.id + 1);'
+        return self.cursor.execute(cmd, (first, last - 1)).fetchone()[0]
+
+    def _assert_ranges_exist(self, table_name, ranges):
+        """
+        Raise an exception if any id of the (first, last) ranges cannot be
+        found in the table.
+
+        The rows of all ranges are counted in one query (per chunk of
+        RANGES_CHUNK ranges); the missing id is only looked for if the count
+        does not match.
+        """
+        for i in range(0, len(ranges), RANGES_CHUNK):
+            chunk = ranges[i:i + RANGES_CHUNK]
+            values = ', '.join(['(?, ?)'] * len(chunk))
+            cmd = f'SELECT COUNT(*) FROM {table_name} '\
+                f'JOIN (VALUES {values}) AS r '\
+                f'ON id BETWEEN r.column1 AND r.column2;'
+            params = [n for r in chunk for n in r]
+            found = self.cursor.execute(cmd, params).fetchone()[0]
+            if found != sum(last - first + 1 for first, last in chunk):
+                for first, last in chunk:
+                    id_ = self._first_missing_id(table_name, first, last)
+                    if id_ is not None:
+                        raise ValueError(f'In database, cannot find a row '
+                                         f'number {id_} in table '
+                                         f'"{table_name}"')
+        return True
+
+    @contextmanager
+    def _savepoint(self, name):
+        """
+        Run the commands of the with block in a transaction of their own:
+        either they all succeed, or they are all cancelled.
+
+        Unless the connection is in autocommit mode, a transaction is opened
+        first if necessary, so that committing remains up to the caller. If
+        the connection has a retry policy, this transaction takes the write
+        lock at once (BEGIN IMMEDIATE, retried when the database is locked),
+        so that the commands of the block cannot fail because of a lock.
+        """
+        conn = self.cursor.connection
+        savepoints = getattr(conn, 'savepoints', [])
+        if conn.isolation_level is not None and not conn.in_transaction:
+            policy = getattr(conn, 'retry_policy', None)
+            if policy is None:
+                self.cursor.execute('BEGIN;')
+            else:
+                policy.run(self.cursor.execute, 'BEGIN IMMEDIATE;')
+        self.cursor.execute(f'SAVEPOINT {name};')
+        savepoints.append(name)
+        try:
+            yield
+        except BaseException:
+            self.cursor.execute(f'ROLLBACK TO SAVEPOINT {name};')
+            self.cursor.execute(f'RELEASE SAVEPOINT {name};')
+            self._invalidate_schema()
+            self.clear_cache()
+            raise
+        finally:
+            savepoints.pop()
+        self.cursor.execute(f'RELEASE SAVEPOINT {name};')
+
+    def _exec(self, table_name, cmd, id_=None, params=()):
         """
         Safe execution of the sql command on existing tables: start by checking
         table exists, then possibly the row id_ too, and finally execute the
-        command. If table_name is provided as None, then no check is run, the
-        command is simply directly executed.
+        command (with its params, if any). If table_name is provided as None,
+        then no check is run, the command is simply directly executed.
         """
         if table_name is not None:
             self._assert_table_exists(table_name)
             if id_ is not None:
                 self._assert_row_exists(table_name, id_)
-        return self.cursor.execute(cmd)
+        conn = self.cursor.connection
+        policy = getattr(conn, 'retry_policy', None)
+        # Inside a transaction, a command failing because of a lock cannot
+        # simply be run again: the whole transaction would have to be
+        if policy is None or conn.in_transaction:
+            return self.cursor.execute(cmd, params)
+        return policy.run(self.cursor.execute, cmd, params,
+                          on_retry=self._rollback_failed)
+
+    def _rollback_failed(self):
+        """Cancel the implicit transaction of a failed command."""
+        if self.cursor.connection.in_transaction:
+            self.cursor.connection.rollback()
+            self._invalidate_schema()
 
     def drop_table(self, name):
         """Remove a table."""
         self._exec(name, f'DROP TABLE `{name}`;')
+        self._invalidate_schema()
+        self._forget_counters(name)
 
     def rename_table(self, name, new_name):
-        """Change a table's name."""
+        """
+        Change a table's name.
+
+        The counters, if enabled, follow the table. The indexes follow it
+        too, but keep their names (SQLite cannot rename an index without
+        building it again).
+        """
+        counters = self._counters(name) is not None
         self._exec(name, f'ALTER TABLE `{name}` RENAME TO `{new_name}`;')
+        if counters:
+            self._drop_counters_triggers(name)
+            self._exec(None, f'UPDATE {COUNTERS_TABLE} SET table_name=? '
+                       f'WHERE table_name=?;', params=(new_name, name))
+            self._create_counters_triggers(new_name)
+        self._invalidate_schema()
 
     def update_table(self, name, id_, content):
         """Update content of row number 'id_' in table 'name'."""
+        self.update_rows(name, {id_: content})
+
+    def update_rows(self, name, rows):
+        """
+        Update content of several rows of table 'name' at once.
+
+        rows is a dict whose keys are the ids of the rows to update (int, or
+        str like get_table() returns them) and the values their new content.
+        All rows are checked first, then updated by a single parametrized
+        statement.
+        """
         col_titles = self.get_cols(name)
-        self._assert_row_exists(name, id_)
-        if len(content) != len(col_titles):
-            raise ValueError(f'In database, {content} requires {len(content)} '
-                             f'columns, but table {name} has only '
-                             f'{len(col_titles)} columns.')
-        pairs = zip(col_titles, content)
-        col_values = ', '.join(f'{p[0]}="{p[1]}"' for p in pairs)
-        self._exec(name, f'UPDATE {name} SET {col_values} WHERE id={id_};')
-
-    def copy_table(self, name1, name2, sort=False):
-        """Copy table name1 as name2."""
+        rows = {int_id(id_): content for id_, content in rows.items()}
+        self._assert_ranges_exist(name, intspan(rows).ranges())
+        for content in rows.values():
+            if len(content) != len(col_titles):
+                raise ValueError(f'In database, {content} requires '
+                                 f'{len(content)} columns, but table {name} '
+                                 f'has only {len(col_titles)} columns.')
+        col_values = ', '.join(f'{title}=?' for title in col_titles)
+        with self._savepoint('update_rows'):
+            self.cursor.executemany(f'UPDATE {name} SET {col_values} '
+                                    f'WHERE id=?;',
+                                    (tuple(content) + (id_, )
+                                     for id_, content in rows.items()))
+
+    def copy_table(self, name1, name2, sort=False, indexes=True):
+        """
+        Copy table name1 as name2 (along with its indexes, unless indexes is
+        False).
+        """
         if self.table_exists(name2):
             raise ValueError(f'In database, action cancelled: a table named '
                              f'"{name2}" already exists. Please rename or '
@@ -161,11 +1195,51 @@ class Operator:
                                  f'{sort} in table "{name1}"')
             orderby = f' ORDER BY ' \
                 f'{self.get_cols(name1, include_id=True)[sort]}'
-        self.create_table(name2, self.get_cols(name1))
-        titles = ', '.join(self.get_cols(name1))
+        self._create_copy(name1, name2)
+        titles = ', '.join(self._stored_cols(name1))
         cmd = f'INSERT INTO {name2} ({titles}) '\
             f'SELECT {titles} FROM {name1}{orderby};'
         self._exec(None, cmd)
+        if indexes:
+            self._copy_indexes(name1, name2)
+        self._invalidate_schema()
+        if self._counters(name1) is not None:
+            self.enable_counters(name2)
+
+    def _copy_indexes(self, name1, name2):
+        """
+        Create on table name2 the same indexes as on table name1 (except the
+        ones already existing). The indexes' names are prefixed with name2
+        instead of name1 (or simply prefixed with name2, if they did not
+        start with name1).
+        """
+        existing = self.list_indexes(name2)
+        for index, sql in self._indexes(name1):
+            if index.startswith(f'{name1}_'):
+                new_index = name2 + index[len(name1):]
+            else:
+                new_index = f'{name2}_{index}'
+            if new_index not in existing:
+                self.cursor.execute(rename_index_sql(sql, new_index,
+                                                     new_table=name2))
+
+    def _is_strict(self, table_name):
+        """True if the table is a STRICT one."""
+        sql = self.cursor.execute('SELECT sql FROM sqlite_master '
+                                  'WHERE type=\'table\' AND name=?;',
+                                  (table_name, )).fetchone()[0]
+        return re.search(r'\bSTRICT\s*$', sql, flags=re.I) is not None
+
+    def _create_copy(self, name1, name2):
+        """Create table name2, empty, with the same structure as name1."""
+        cols = self.get_cols(name1)
+        self.create_table(name2, cols,
+                          col_types=dict(zip(cols, self.get_col_types(name1))),
+                          strict=self._is_strict(name1))
+
+    def _stored_cols(self, table_name):
+        """List all columns of a table, hidden ones included (but not id)."""
+        return [_[0] for _ in self._columns(table_name)][1:]
 
     def _original_name(self, name):
         """Create a table name that does not already exists in the database."""
@@ -176,44 +1250,300 @@ class Operator:
             i += 1
         return new_name
 
-    def sort_table(self, name, n):
-        """Sort table "name" using column number n"""
+    def _rebuild_table(self, name, sort=False):
+        """
+        Recreate a table from scratch (sorting its rows by column number
+        sort, if given). Its indexes are created again once the new table
+        is filled and renamed, so that each of them is built only once.
+        """
+        indexes = list(self._indexes(name))
         temp_name = self._original_name(name)
-        self.copy_table(name, temp_name, sort=n)
+        self.copy_table(name, temp_name, sort=sort, indexes=False)
         self.remove_table(name)
         self.rename_table(temp_name, name)
+        for _, sql in indexes:
+            self.cursor.execute(sql)
+        self._invalidate_schema()
+
+    def sort_table(self, name, n):
+        """Sort table "name" using column number n"""
+        self._rebuild_table(name, sort=n)
+
+    def _columns(self, table_name):
+        """Return the (cached) list of columns' (name, type) of a table."""
+        self._assert_table_exists(table_name)
+        schema = self._schema()
+        if table_name not in schema.columns:
+            schema.columns[table_name] = self.cursor.connection.execute(
+                'SELECT name, type FROM pragma_table_info(?);',
+                (table_name, )).fetchall()
+        return schema.columns[table_name]
 
     def get_cols(self, table_name, include_id=False):
         """List all columns of a given table."""
-        cursor = self._exec(table_name, f'SELECT * from {table_name};')
         start = 0 if include_id else 1
-        return [_[0] for _ in cursor.description][start:]
+        return [_[0] for _ in self._columns(table_name)][start:]
 
+    def _indexes(self, table_name):
+        """
+        Return the (cached) list of (name, sql) of the indexes created on a
+        table (the ones automatically created by SQLite are not included).
+        """
+        self._assert_table_exists(table_name)
+        schema = self._schema()
+        if table_name not in schema.indexes:
+            schema.indexes[table_name] = self.cursor.connection.execute(
+                'SELECT name, sql FROM sqlite_master WHERE type=\'index\' '
+                'AND tbl_name=? AND sql IS NOT NULL;', (table_name, ))\
+                .fetchall()
+        return schema.indexes[table_name]
+
+    def list_indexes(self, table_name):
+        """List the indexes of a table."""
+        return [index for index, _ in self._indexes(table_name)]
+
+    def create_index(self, table_name, cols, name=None, unique=False,
+                     where=None, include=None):
+        """
+        Create an index on the cols of a table.
+
+        The index is named after the table's and columns' names, unless a
+        name is given (starting with the table's name is recommended: the
+        copies of the table then get their indexes named after their own
+        names).
+        If where is given (a SQL condition), a partial index is created,
+        only covering the matching rows. Columns listed in include are
+        appended to the index, to make it a covering one (queries reading
+        only cols and include columns need not read the table itself). Note
+        that SQLite has no real INCLUDE clause: with unique=True, the include
+        columns are part of the uniqueness constraint too.
+        """
+        cols = list(cols) + list(include or [])
+        available = ['id'] + self._stored_cols(table_name)
+        for col in cols:
+            if col not in available:
+                raise ValueError(f'In database, cannot find a column named '
+                                 f'"{col}" in table "{table_name}"')
+        if name is None:
+            name = f'{table_name}_{"_".join(cols)}_idx'
+        unique = 'UNIQUE ' if unique else ''
+        where = f' WHERE {where}' if where else ''
+        self._exec(table_name, f'CREATE {unique}INDEX `{name}` ON '
+                   f'{table_name} ({", ".join(cols)}){where};')
+        self._invalidate_schema()
+        return name
+
+    def drop_index(self, name):
+        """Remove an index."""
+        cmd = 'SELECT EXISTS(SELECT 1 FROM sqlite_master '\
+            'WHERE type=\'index\' AND name=?);'
+        if not self.cursor.execute(cmd, (name, )).fetchone()[0]:
+            raise ValueError(f'In database, cannot find an index named '
+                             f'"{name}"')
+        self._exec(None, f'DROP INDEX `{name}`;')
+        self._invalidate_schema()
+
+    def get_col_types(self, table_name, include_id=False):
+        """List the declared types of all columns of a given table."""
+        types = dict(self._columns(table_name))
+        return [types[title]
+                for title in self.get_cols(table_name, include_id=include_id)]
+
+    @cached
     def get_rows_nb(self, table_name):
-        """Return rows' number of a given table."""
+        """
+        Return rows' number of a given table (read from its counters, if
+        enabled).
+        """
+        self._assert_table_exists(table_name)
+        counters = self._counters(table_name)
+        if counters is not None:
+            return counters[0]
         cmd = f'SELECT COUNT(*) FROM {table_name};'
         return tuple(self._exec(table_name, cmd))[0][0]
 
+    def _counters(self, table_name):
+        """
+        Return the (rows' number, free rows' number) counters of a table, or
+        None if they are not enabled.
+        """
+        if COUNTERS_TABLE not in self._all_tables():
+            return None
+        return self.cursor.execute(f'SELECT rows_nb, free_nb FROM '
+                                   f'{COUNTERS_TABLE} WHERE table_name=?;',
+                                   (table_name, )).fetchone()
+
+    def _free_clause(self, table_name):
+        """
+        Return the SQL condition matching the rows that are free (all rows
+        of an Operator's table are).
+        """
+        return '1'
+
+    def _free_expr(self, table_name, row):
+        """
+        Return the SQL expression telling whether row (NEW or OLD, in a
+        trigger) is free.
+        """
+        return '1'
+
+    def _free_cols(self, table_name):
+        """List the columns whose update may change whether a row is free."""
+        return []
+
+    def _count(self, table_name):
+        """Count the rows of a table and store the result in its counters."""
+        self._exec(None, f'INSERT OR REPLACE INTO {COUNTERS_TABLE} VALUES '
+                   f'(?, (SELECT COUNT(*) FROM {table_name}), '
+                   f'(SELECT COUNT(*) FROM {table_name} '
+                   f'WHERE {self._free_clause(table_name)}));',
+                   params=(table_name, ))
+
+    def _create_counters_triggers(self, table_name):
+        """Create the triggers keeping the counters of a table up to date."""
+        where = f'WHERE table_name = \'{table_name}\''
+        new = self._free_expr(table_name, 'NEW')
+        old = self._free_expr(table_name, 'OLD')
+        triggers = {
+            'insert': ('INSERT', f'rows_nb = rows_nb + 1, '
+                       f'free_nb = free_nb + ({new})'),
+            'delete': ('DELETE', f'rows_nb = rows_nb - 1, '
+                       f'free_nb = free_nb - ({old})')}
+        free_cols = self._free_cols(table_name)
+        if free_cols:
+            triggers['update'] = (f'UPDATE OF {", ".join(free_cols)}',
+                                  f'free_nb = free_nb + ({new}) - ({old})')
+        for suffix, (event, assignments) in triggers.items():
+            self._exec(None, f'CREATE TRIGGER IF NOT EXISTS '
+                       f'`{table_name}_count_{suffix}` AFTER {event} '
+                       f'ON `{table_name}` BEGIN UPDATE {COUNTERS_TABLE} '
+                       f'SET {assignments} {where}; END;')
+
+    def _drop_counters_triggers(self, table_name):
+        """Remove the triggers keeping the counters of a table up to date."""
+        for suffix in ('insert', 'delete', 'update'):
+            self._exec(None, f'DROP TRIGGER IF EXISTS '
+                       f'`{table_name}_count_{suffix}`;')
+
+    def enable_counters(self, table_name):
+        """
+        Keep the number of rows of a table (and of its free rows, for a
+        Ts_Operator) in the COUNTERS_TABLE, so that get_rows_nb() (and
+        draw_rows()) need not count them.
+
+        The counters are updated by triggers on the table. They follow the
+        table when it is renamed, copied or sorted.
+        """
+        self._assert_table_exists(table_name)
+        if COUNTERS_TABLE not in self._all_tables():
+            self._exec(None, f'CREATE TABLE {COUNTERS_TABLE} '
+                       f'(table_name TEXT PRIMARY KEY, rows_nb INTEGER, '
+                       f'free_nb INTEGER);')
+            self._invalidate_schema()
+        self._create_counters_triggers(table_name)
+        self._count(table_name)
+
+    def disable_counters(self, table_name):
+        """Stop counting the rows of a table."""
+        self._assert_table_exists(table_name)
+        self._drop_counters_triggers(table_name)
+        self._forget_counters(table_name)
+
+    def _forget_counters(self, name):
+        """Remove the counters of a table."""
+        if COUNTERS_TABLE in self._all_tables():
+            self._exec(None, f'DELETE FROM {COUNTERS_TABLE} '
+                       f'WHERE table_name=?;', params=(name, ))
+
+    def _iter_fetch(self, cmd, params=(), batch_size=None):
+        """
+        Execute cmd and yield the resulting rows, fetched batch_size at a
+        time (BATCH_SIZE by default).
+
+        A dedicated cursor is used, so that other commands can be run on the
+        Operator while iterating.
+        """
+        batch_size = batch_size or BATCH_SIZE
+        cursor = self.cursor.connection.cursor()
+        try:
+            cursor.execute(cmd, params)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield from rows
+        finally:
+            cursor.close()
+
+    def iter_rows(self, cols, table_name, where_clause, batch_size=None):
+        """
+        Iterate over selected columns whose values match the where_clause,
+        fetching batch_size rows at a time.
+        """
+        self._assert_table_exists(table_name)
+        cols = ','.join(cols)
+        cmd = f'SELECT {cols} FROM {table_name} WHERE {where_clause};'
+        return self._iter_fetch(cmd, batch_size=batch_size)
+
+    @cached
     def get_rows(self, cols, table_name, where_clause):
         """Return selected columns whose values match the where_clause."""
+        return list(self.iter_rows(cols, table_name, where_clause))
+
+    def _rows_by_ids(self, table_name, cols, ids):
+        """
+        Return selected columns of the rows matching ids, as a dict whose
+        keys are the ids. Missing ids are skipped.
+        """
         cols = ','.join(cols)
-        cmd = f'SELECT {cols} FROM {table_name} WHERE {where_clause};'
-        return self._exec(table_name, cmd).fetchall()
+        found = {}
+        for i in range(0, len(ids), IDS_CHUNK):
+            chunk = ids[i:i + IDS_CHUNK]
+            qmarks = ', '.join('?' * len(chunk))
+            cmd = f'SELECT id, {cols} FROM {table_name} '\
+                f'WHERE id IN ({qmarks});'
+            found.update((row[0], row[1:])
+                         for row in self.cursor.execute(cmd, chunk))
+        return found
 
-    def get_table(self, name, include_headers=False, sort=False):
-        """Return a list of all table's lines."""
-        headers = []
-        cols = ','.join(self.get_cols(name, include_id=True))
-        content = self._exec(name, f'SELECT {cols} FROM {name};').fetchall()
-        content = [(str(t[0]), ) + t[1:] for t in content]
+    def _fetch_by_ids(self, table_name, cols, ids):
+        """
+        Return selected columns of the rows matching ids, in the same order
+        as ids. Missing ids are skipped.
+        """
+        found = self._rows_by_ids(table_name, cols, ids)
+        return [found[id_] for id_ in ids if id_ in found]
+
+    def iter_table(self, name, include_headers=False, sort=False,
+                   batch_size=None):
+        """
+        Iterate over all table's lines, fetching batch_size rows at a time.
+
+        The rows are sorted by SQLite (ties are kept in ids' order).
+        """
+        cols = self.get_cols(name, include_id=True)
+        orderby = ''
         if sort:
-            if sort not in [n for n in range(len(content[0]))]:
+            if sort not in range(len(cols)):
                 raise ValueError(f'In database, cannot find a column number '
                                  f'{sort} in table "{name}"')
-            content = sorted(content, key=lambda row: row[sort])
+            orderby = f' ORDER BY {cols[sort]}, id'
+        cmd = f'SELECT {",".join(cols)} FROM {name}{orderby};'
+        content = ((str(t[0]), ) + t[1:]
+                   for t in self._iter_fetch(cmd, batch_size=batch_size))
         if include_headers:
-            headers = [tuple(self.get_cols(name, include_id=True))]
-        return headers + content
+            return itertools.chain([tuple(cols)], content)
+        return content
+
+    @cached
+    def get_table(self, name, include_headers=False, sort=False):
+        """Return a list of all table's lines."""
+        return list(self.iter_table(name, include_headers=include_headers,
+                                    sort=sort))
+
+    def table(self, name, cols=None, page_size=None):
+        """Return a lazy view of the table (see Table)."""
+        return Table(self, name, cols=cols, page_size=page_size)
 
     def table_to_text(self, name):
         """Return table's content as text in a tabular."""
@@ -223,15 +1553,62 @@ class Operator:
     def remove_table(self, name):
         """Remove table name."""
         self._exec(name, f'DROP TABLE {name};')
+        self._invalidate_schema()
+        self._forget_counters(name)
+
+    def _cols_definition(self, col_titles, col_types=None):
+        """
+        Return the SQL definition of the columns. col_types is a dict
+        giving the types of some columns, the other ones are TEXT.
+        """
+        col_types = col_types or {}
+        for title, type_ in col_types.items():
+            if title not in col_titles:
+                raise ValueError(f'In database, cannot set the type of '
+                                 f'column "{title}" that is not in '
+                                 f'{list(col_titles)}.')
+            if not re.fullmatch(r'[A-Za-z][\w ]*(\([\d, ]+\))?', type_):
+                raise ValueError(f'In database, invalid type "{type_}" for '
+                                 f'column "{title}".')
+        return ', '.join(f'{title} {col_types.get(title, "TEXT")}'
+                         for title in col_titles)
+
+    def _table_options(self, strict):
+        """Return the SQL options of a table to create."""
+        if not strict:
+            return ''
+        if sqlite3.sqlite_version_info < STRICT_TABLES_VERSION:
+            raise ValueError(f'In database, STRICT tables require SQLite '
+                             f'{".".join(map(str, STRICT_TABLES_VERSION))} '
+                             f'or later (SQLite version is '
+                             f'{sqlite3.sqlite_version}).')
+        return ' STRICT'
 
-    def _create_cmd(self, name, col_titles):
-        titles = ' TEXT, '.join(col_titles) + ' TEXT'
-        return f'CREATE TABLE {name} (id INTEGER PRIMARY KEY, {titles});'
+    def _create_cmd(self, name, col_titles, col_types=None, strict=False):
+        cols = self._cols_definition(col_titles, col_types)
+        return f'CREATE TABLE {name} (id INTEGER PRIMARY KEY, {cols})'\
+            f'{self._table_options(strict)};'
 
-    def create_table(self, name, col_titles, content=None):
-        """Create table name using given col_titles and content."""
-        cmd = self._create_cmd(name, col_titles)
+    def create_table(self, name, col_titles, content=None, col_types=None,
+                     strict=False, **options):
+        """
+        Create table name using given col_titles and content.
+
+        col_types is a dict giving the SQL types of some columns (the other
+        ones are TEXT). col_titles can also be a dataclass, whose fields
+        then give the columns' titles and types (and content may be made of
+        instances of this dataclass). If strict is True, a STRICT table is
+        created. options are passed to _create_cmd() (they are the ones of
+        subclasses, like Ts_Operator's).
+        """
+        if dataclasses.is_dataclass(col_titles):
+            col_titles, col_types = dataclass_columns(col_titles)
+        cmd = self._create_cmd(name, col_titles, col_types=col_types,
+                               strict=strict, **options)
         self._exec(None, cmd)
+        self._invalidate_schema()
+        if self.counters:
+            self.enable_counters(name)
         if content is not None:
             self.insert_rows(name, content, col_titles=col_titles)
 
@@ -243,22 +1620,178 @@ class Operator:
     def _content(self, rows):
         return rows
 
-    def insert_rows(self, table_name, rows, col_titles=None):
-        """Insert rows to the table."""
-        if rows:
-            if col_titles is None:
-                col_titles = self.get_cols(table_name)
-            for row in rows:
-                if len(col_titles) != len(row):
-                    data = [f"'{item}'" for item in row]
-                    data = ', '.join(data)
-                    raise ValueError(f'In database, {data} requires {len(row)}'
-                                     f' columns, but table {table_name} has '
-                                     f'only {len(col_titles)} columns.')
-            titles, qmarks = self._titles_and_qmarks(col_titles)
-            cmd = f'INSERT INTO {table_name}({titles}) VALUES({qmarks})'
-            content = self._content(rows)
-            self.cursor.executemany(cmd, content)
+    def _checked_rows(self, table_name, rows, col_titles):
+        """Yield the rows, after having checked their lengths."""
+        for row in rows:
+            if dataclasses.is_dataclass(row):
+                row = dataclasses.astuple(row)
+            if len(col_titles) != len(row):
+                data = [f"'{item}'" for item in row]
+                data = ', '.join(data)
+                raise ValueError(f'In database, {data} requires {len(row)}'
+                                 f' columns, but table {table_name} has '
+                                 f'only {len(col_titles)} columns.')
+            yield row
+
+    def _assert_can_commit(self, commit_every):
+        """Check commit_every is not used inside a savepoint."""
+        savepoints = getattr(self.cursor.connection, 'savepoints', [])
+        if commit_every is not None and savepoints:
+            raise ValueError(f'In database, cannot commit every '
+                             f'{commit_every} rows inside savepoint '
+                             f'"{savepoints[-1]}".')
+
+    def insert_rows(self, table_name, rows, col_titles=None,
+                    commit_every=None):
+        """
+        Insert rows to the table.
+
+        rows can be any iterable, a generator for instance: it is read only
+        once, and each row is checked just before being inserted, so that
+        the memory used does not depend on the number of rows.
+
+        By default, the insertion is atomic (if a row is wrong, no row is
+        inserted). If commit_every is given, the rows are inserted and
+        committed by chunks of commit_every rows instead. A commit would
+        release the savepoints opened so far, so commit_every cannot be
+        used inside one of them (for instance in a ContextManager in
+        testing mode, or in a WriteQueue's call).
+        """
+        self._assert_can_commit(commit_every)
+        rows = iter(rows)
+        first = next(rows, None)
+        if first is None:
+            return
+        rows = itertools.chain([first], rows)
+        if col_titles is None:
+            col_titles = self.get_cols(table_name)
+        titles, qmarks = self._titles_and_qmarks(col_titles)
+        cmd = f'INSERT INTO {table_name}({titles}) VALUES({qmarks})'
+        content = self._content(self._checked_rows(table_name, rows,
+                                                   col_titles))
+        if commit_every is None:
+            with self._savepoint('insert_rows'):
+                self.cursor.executemany(cmd, content)
+        else:
+            while True:
+                chunk = list(itertools.islice(content, commit_every))
+                if not chunk:
+                    break
+                self.cursor.executemany(cmd, chunk)
+                self.cursor.connection.commit()
+
+    def export_table(self, name, fileobj, fmt='csv', compress=False,
+                     progress=None, batch_size=None):
+        """
+        Write the table's rows (without their ids) to the text file fileobj,
+        in the fmt format (one of FORMATS). The rows are fetched, and
+        written, batch_size at a time, so that the memory used does not
+        depend on the size of the table.
+
+        A CSV file starts with a row of the columns' titles; a JSON Lines
+        file contains one object per row, whose keys are the titles. If
+        compress is True, the content is gzipped, and fileobj must be a
+        binary file. progress, if given, is called with the number of rows
+        written so far, after each batch. Return the number of rows written.
+        """
+        _check_format(fmt)
+        batch_size = batch_size or BATCH_SIZE
+        cols = self.get_cols(name)
+        cmd = f'SELECT {", ".join(cols)} FROM {name} ORDER BY id;'
+        rows = self._iter_fetch(cmd, batch_size=batch_size)
+        done = 0
+        with _text_file(fileobj, 'w', compress) as f:
+            if fmt == 'csv':
+                writer = csv.writer(f)
+                writer.writerow(cols)
+            while True:
+                batch = list(itertools.islice(rows, batch_size))
+                if not batch:
+                    break
+                if fmt == 'csv':
+                    writer.writerows(batch)
+                else:
+                    f.writelines(json.dumps(dict(zip(cols, row)),
+                                            ensure_ascii=False) + '\n'
+                                 for row in batch)
+                done += len(batch)
+                if progress is not None:
+                    progress(done)
+        return done
+
+    def _read_rows(self, f, fmt, name):
+        """
+        Return the columns' titles found in the text file f, and an iterator
+        over its rows.
+        """
+        if fmt == 'csv':
+            reader = csv.reader(f)
+            return (next(reader, []), reader)
+        lines = (json.loads(line) for line in f if line.strip())
+        first = next(lines, None)
+        if first is None:
+            return ([], iter([]))
+        cols = list(first)
+
+        def rows():
+            for n, item in enumerate(itertools.chain([first], lines)):
+                if list(item) != cols:
+                    raise ValueError(f'In database, cannot import line '
+                                     f'{n + 1} into table "{name}": its keys '
+                                     f'{list(item)} do not match {cols}.')
+                yield tuple(item.values())
+        return (cols, rows())
+
+    def import_table(self, name, fileobj, fmt='csv', compress=False,
+                     progress=None, batch_size=None, commit_every=None,
+                     col_types=None):
+        """
+        Insert the rows of the text file fileobj (in the fmt format, as
+        written by export_table()) into the table, that is created if it
+        does not exist yet (with col_types, see create_table(): its columns
+        are TEXT by default).
+
+        A CSV file does not keep the values' types: they are all read as
+        text, and then converted according to the columns' types (so that
+        numbers are restored in INTEGER or REAL columns, for instance with
+        col_types=dict(zip(cols, db.get_col_types(name))) when creating the
+        table). NULL values are lost: they are exported as empty strings,
+        and imported as such. A JSON Lines file keeps the numbers and NULL
+        values.
+
+        The rows are read one at a time and inserted by insert_rows() (see
+        its commit_every argument, that cannot be used inside a savepoint).
+        If compress is True, the content is gunzipped, and fileobj must be a
+        binary file. progress, if given, is called with the number of rows
+        read so far, every batch_size rows. Return the number of rows read.
+        """
+        _check_format(fmt)
+        self._assert_can_commit(commit_every)
+        batch_size = batch_size or BATCH_SIZE
+        done = 0
+        with _text_file(fileobj, 'r', compress) as f:
+            cols, rows = self._read_rows(f, fmt, name)
+            if not cols:
+                return 0
+            if not self.table_exists(name):
+                self.create_table(name, cols, col_types=col_types)
+            elif cols != self.get_cols(name):
+                raise ValueError(f'In database, cannot import columns {cols} '
+                                 f'into table "{name}", whose columns are '
+                                 f'{self.get_cols(name)}.')
+
+            def counted(rows):
+                nonlocal done
+                for row in rows:
+                    yield row
+                    done += 1
+                    if progress is not None and not done % batch_size:
+                        progress(done)
+            self.insert_rows(name, counted(rows), col_titles=cols,
+                             commit_every=commit_every)
+        if progress is not None and done % batch_size:
+            progress(done)
+        return done
 
     def merge_tables(self, name1, name2):
         """Insert rows of table name1 table into name2."""
@@ -272,28 +1805,78 @@ class Operator:
         self._exec(None, f'INSERT INTO {name2} ({titles2}) '
                    f'SELECT {titles1} FROM {name1};')
 
-    def _reset_table_ids(self, name):
-        """Reset the ids of a table to remove gaps created by rows removals."""
-        temp_name = self._original_name(name)
-        self.copy_table(name, temp_name)
-        self.remove_table(name)
-        self.rename_table(temp_name, name)
+    def _reset_table_ids(self, name, removed=None):
+        """
+        Reset the ids of a table to remove gaps created by rows removals.
+
+        If the removed ids are known, they must be given as a sorted list of
+        (first, last) ranges; then, if the ids were contiguous (from 1)
+        before the removal, only the ids located above the first removed one
+        are shifted down. Otherwise (the table may have had gaps already,
+        e.g. after rows have been deleted without Operator), the whole table
+        is rebuilt.
+        """
+        if removed is not None and not self._were_contiguous(name, removed):
+            removed = None
+        if removed is None:
+            self._rebuild_table(name)
+        else:
+            self._shift_ids(name, removed)
+
+    def _id_bounds(self, table_name):
+        """Return the first and last ids of the table (None if empty)."""
+        # (Two subqueries, so that each can use the min/max optimization)
+        cmd = f'SELECT (SELECT MIN(id) FROM {table_name}), '\
+            f'(SELECT MAX(id) FROM {table_name});'
+        return self._exec(table_name, cmd).fetchone()
+
+    def _were_contiguous(self, name, removed):
+        """
+        True if the ids of the table were 1..n before the removed ranges of
+        ids were removed.
+        """
+        first, last = self._id_bounds(name)
+        first = min(first or MAX_ID, removed[0][0])
+        last = max(last or 0, removed[-1][1])
+        removed_nb = sum(b - a + 1 for a, b in removed)
+        return first == 1 \
+            and last == self.get_rows_nb(name) + removed_nb
+
+    def _shift_ids(self, name, removed):
+        """
+        Shift down the ids located above the removed ones.
+
+        Each segment between two removed ranges is shifted by the number of
+        ids removed below it. The new ids are first stored as negative
+        values, so that no update can collide with a not yet shifted id.
+        """
+        shift = 0
+        segments = []
+        for i, (first, last) in enumerate(removed):
+            shift += last - first + 1
+            upper = removed[i + 1][0] if i + 1 < len(removed) else MAX_ID
+            segments.append((shift, last, upper))
+        self.cursor.executemany(f'UPDATE {name} SET id = ? - id '
+                                f'WHERE id > ? AND id < ?;', segments)
+        self._exec(None, f'UPDATE {name} SET id = -id WHERE id < 0;')
 
     def remove_row(self, table_name, id_):
         """Remove row matching id_ in the table."""
+        id_ = int_id(id_)
         cmd = f'DELETE FROM {table_name} WHERE id = {id_};'
-        self._exec(table_name, cmd, id_=id_)
-        self._reset_table_ids(table_name)
+        with self._savepoint('remove_row'):
+            self._exec(table_name, cmd, id_=id_)
+            self._reset_table_ids(table_name, removed=[(id_, id_)])
 
     def remove_rows(self, table_name, id_span):
         """Remove rows matching the ids from id_span from the table."""
+        ranges = intspan(id_span).ranges()
         self._assert_table_exists(table_name)
-        for id_ in list(intspan(id_span)):
-            self._assert_row_exists(table_name, id_)
-        values = intspan2sqllist(id_span)
-        cmd = f'DELETE FROM {table_name} WHERE id IN {values};'
-        self._exec(table_name, cmd)
-        self._reset_table_ids(table_name)
+        self._assert_ranges_exist(table_name, ranges)
+        with self._savepoint('remove_rows'):
+            self.cursor.executemany(f'DELETE FROM {table_name} '
+                                    f'WHERE id BETWEEN ? AND ?;', ranges)
+            self._reset_table_ids(table_name, removed=ranges)
 
 
 class Ts_Operator(Operator):
@@ -305,15 +1888,232 @@ class Ts_Operator(Operator):
     - it's possible to timestamp any row
     - it's possible to reset the timestamp of the most oldest timestamped rows
     - it's possible to randomly draw several rows
+
+    By default, the timestamps are stored as text ('YYYY-MM-DD HH:MM:SS.SSS',
+    UTC). If int_timestamps is True, the tables are created so that the
+    timestamps are stored as integers (the number of microseconds since the
+    Epoch), along with an index on the timestamps and a partial index on
+    the rows not timestamped. Existing tables can be turned to this format
+    by migrate_timestamps(). The format is a property of each table (the
+    tables storing integers are listed in the INT_TIMESTAMPS_TABLE),
+    whatever the Ts_Operator working on it.
+
+    If generations is True, the tables are created with a second hidden
+    column, "generation", and each table gets a generation counter (stored
+    in the GENERATIONS_TABLE). A row is free (may be drawn when the oldest
+    prevail) if its generation is older than the table's counter, and
+    timestamping a row sets its generation to the counter's. A full reset
+    then only increments the counter. Existing tables can be turned to this
+    mode by enable_generations().
     """
 
+    def __init__(self, cursor, int_timestamps=False, generations=False,
+                 cache_size=0, counters=False):
+        super().__init__(cursor, cache_size=cache_size, counters=counters)
+        self.int_timestamps = int_timestamps
+        self.generations = generations
+
+    def _has_int_timestamps(self, table_name):
+        """True if the table stores its timestamps as integers."""
+        if INT_TIMESTAMPS_TABLE not in self._all_tables():
+            return False
+        return self._exec(None, f'SELECT EXISTS(SELECT 1 FROM '
+                          f'{INT_TIMESTAMPS_TABLE} WHERE table_name=?);',
+                          params=(table_name, )).fetchone()[0] == 1
+
+    def _set_int_timestamps(self, table_name):
+        """Record that the table stores its timestamps as integers."""
+        if INT_TIMESTAMPS_TABLE not in self._all_tables():
+            self._exec(None, f'CREATE TABLE {INT_TIMESTAMPS_TABLE} '
+                       f'(table_name TEXT PRIMARY KEY);')
+            self._invalidate_schema()
+        self._exec(None, f'INSERT OR IGNORE INTO {INT_TIMESTAMPS_TABLE} '
+                   f'VALUES (?);', params=(table_name, ))
+
+    def _has_generations(self, table_name):
+        """True if the table has a generation column."""
+        cols = self._stored_cols(table_name)
+        return cols[-2:] == ['timestamp', 'generation']
+
     def get_cols(self, table_name, include_id=False):
-        return super().get_cols(table_name, include_id=include_id)[:-1]
+        hidden = 2 if self._has_generations(table_name) else 1
+        return super().get_cols(table_name, include_id=include_id)[:-hidden]
 
-    def _create_cmd(self, name, col_titles):
-        titles = ' TEXT, '.join(col_titles) + ' TEXT, '
+    def _create_cmd(self, name, col_titles, col_types=None, strict=False,
+                    generations=False, int_timestamps=False):
+        cols = self._cols_definition(col_titles, col_types)
+        # STRICT tables' INTEGER columns cannot store text timestamps
+        ts_type = 'ANY' if strict and not int_timestamps else 'INTEGER'
+        generation = ', generation INTEGER DEFAULT 0' if generations else ''
         return f'CREATE TABLE {name} (id INTEGER PRIMARY KEY, '\
-            f'{titles}timestamp INTEGER);'
+            f'{cols}, timestamp {ts_type}{generation})'\
+            f'{self._table_options(strict)};'
+
+    def _create_timestamps_indexes(self, name):
+        """Create the indexes used along with integer timestamps."""
+        self.cursor.execute(f'CREATE INDEX IF NOT EXISTS {name}_timestamp_idx '
+                            f'ON {name}(timestamp);')
+        self.cursor.execute(f'CREATE INDEX IF NOT EXISTS {name}_free_idx '
+                            f'ON {name}(id) WHERE timestamp=0;')
+        self._invalidate_schema()
+
+    def _create_generations_index(self, name):
+        """Create the index used along with generations."""
+        self.cursor.execute(f'CREATE INDEX IF NOT EXISTS '
+                            f'{name}_generation_idx ON {name}(generation);')
+        self._invalidate_schema()
+
+    def create_table(self, name, col_titles, content=None, col_types=None,
+                     strict=False, generations=None, int_timestamps=None):
+        """
+        Create table name using given col_titles and content (see
+        Operator.create_table()).
+
+        generations and int_timestamps default to the Ts_Operator's settings.
+        """
+        if generations is None:
+            generations = self.generations
+        if int_timestamps is None:
+            int_timestamps = self.int_timestamps
+        super().create_table(name, col_titles, content=content,
+                             col_types=col_types, strict=strict,
+                             generations=generations,
+                             int_timestamps=int_timestamps)
+        if int_timestamps:
+            self._set_int_timestamps(name)
+            self._create_timestamps_indexes(name)
+        if generations:
+            self._create_generations_index(name)
+
+    def _create_copy(self, name1, name2):
+        # The indexes are copied (or not) by copy_table()
+        cols = self.get_cols(name1)
+        int_timestamps = self._has_int_timestamps(name1)
+        self._exec(None, self._create_cmd(
+            name2, cols, col_types=dict(zip(cols, self.get_col_types(name1))),
+            strict=self._is_strict(name1),
+            generations=self._has_generations(name1),
+            int_timestamps=int_timestamps))
+        self._invalidate_schema()
+        if int_timestamps:
+            self._set_int_timestamps(name2)
+
+    def copy_table(self, name1, name2, sort=False, indexes=True):
+        super().copy_table(name1, name2, sort=sort, indexes=indexes)
+        if self._has_generations(name1):
+            self._set_generation(name2, self._generation(name1))
+            if self._counters(name2) is not None:
+                self._count(name2)
+
+    def rename_table(self, name, new_name):
+        generations = self._has_generations(name)
+        super().rename_table(name, new_name)
+        if generations:
+            self._exec(None, f'UPDATE {GENERATIONS_TABLE} SET table_name=? '
+                       f'WHERE table_name=?;', params=(new_name, name))
+        if INT_TIMESTAMPS_TABLE in self._all_tables():
+            self._exec(None, f'UPDATE {INT_TIMESTAMPS_TABLE} '
+                       f'SET table_name=? WHERE table_name=?;',
+                       params=(new_name, name))
+
+    def _forget_records(self, name):
+        """
+        Remove the generation counter of a table, and the record of its
+        timestamps' format.
+        """
+        for internal in (GENERATIONS_TABLE, INT_TIMESTAMPS_TABLE):
+            if internal in self._all_tables():
+                self._exec(None, f'DELETE FROM {internal} '
+                           f'WHERE table_name=?;', params=(name, ))
+
+    def drop_table(self, name):
+        super().drop_table(name)
+        self._forget_records(name)
+
+    def remove_table(self, name):
+        super().remove_table(name)
+        self._forget_records(name)
+
+    def _generation(self, table_name):
+        """Return the current generation of a table."""
+        if GENERATIONS_TABLE in self._all_tables():
+            row = self._exec(None, f'SELECT generation FROM '
+                             f'{GENERATIONS_TABLE} WHERE table_name=?;',
+                             params=(table_name, )).fetchone()
+            if row is not None:
+                return row[0]
+        return 1
+
+    def _set_generation(self, table_name, generation):
+        """Set the current generation of a table."""
+        if GENERATIONS_TABLE not in self._all_tables():
+            self._exec(None, f'CREATE TABLE {GENERATIONS_TABLE} '
+                       f'(table_name TEXT PRIMARY KEY, generation INTEGER);')
+            self._invalidate_schema()
+        self._exec(None, f'INSERT OR REPLACE INTO {GENERATIONS_TABLE} '
+                   f'VALUES (?, ?);', params=(table_name, generation))
+
+    def enable_generations(self, table_name):
+        """
+        Add a generation column to an existing table, the timestamped rows
+        belonging to the current generation.
+        """
+        if self._has_generations(table_name):
+            return
+        self._exec(table_name, f'ALTER TABLE {table_name} '
+                   f'ADD COLUMN generation INTEGER DEFAULT 0;')
+        self._invalidate_schema()
+        self._set_generation(table_name, 1)
+        self._exec(None, f'UPDATE {table_name} SET generation=1 '
+                   f'WHERE timestamp != 0;')
+        self._create_generations_index(table_name)
+        if self._counters(table_name) is not None:
+            self._drop_counters_triggers(table_name)
+            self.enable_counters(table_name)
+
+    def _free_clause(self, table_name):
+        """Return the SQL condition matching the rows that are free."""
+        if self._has_generations(table_name):
+            return f'generation < {self._generation(table_name)}'
+        return 'timestamp=0'
+
+    def _free_expr(self, table_name, row):
+        if self._has_generations(table_name):
+            return f'{row}.generation < COALESCE((SELECT generation FROM '\
+                f'{GENERATIONS_TABLE} WHERE table_name = \'{table_name}\'), 1)'
+        return f'{row}.timestamp = 0'
+
+    def _free_cols(self, table_name):
+        if self._has_generations(table_name):
+            return ['timestamp', 'generation']
+        return ['timestamp']
+
+    def enable_counters(self, table_name):
+        # The triggers of tables having generations read the
+        # GENERATIONS_TABLE, that must then exist
+        if self._has_generations(table_name) \
+                and GENERATIONS_TABLE not in self._all_tables():
+            self._set_generation(table_name, self._generation(table_name))
+        super().enable_counters(table_name)
+
+    def _mark_clause(self, table_name):
+        """Return the SQL assignments that timestamp rows."""
+        if self._has_generations(table_name):
+            return f'timestamp = ?, '\
+                f'generation = {self._generation(table_name)}'
+        return 'timestamp = ?'
+
+    def migrate_timestamps(self, table_name):
+        """
+        Turn text timestamps of the table to integer ones and create the
+        related indexes.
+        """
+        self._exec(table_name, f"""UPDATE {table_name}
+    SET timestamp = CAST(ROUND((julianday(timestamp) - 2440587.5)
+    * 86400000000) AS INTEGER)
+    WHERE typeof(timestamp) = 'text';""")
+        self._set_int_timestamps(table_name)
+        self._create_timestamps_indexes(table_name)
 
     def _titles_and_qmarks(self, col_titles):
         titles = ', '.join(list(col_titles) + ['timestamp'])
@@ -321,40 +2121,652 @@ class Ts_Operator(Operator):
         return (titles, qmarks)
 
     def _content(self, rows):
-        return [item + (0, ) for item in rows]
+        return (tuple(item) + (0, ) for item in rows)
+
+    def _now(self, table_name):
+        """Return the timestamp of the current time, in the table's format."""
+        if self._has_int_timestamps(table_name):
+            return time.time_ns() // 1000
+        return datetime.now(timezone.utc)\
+            .strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
 
     def _timestamp(self, table_name, id_):
         """Set timestamp to entry matching id_ in the table."""
-        cmd = f"""UPDATE {table_name} SET timestamp = strftime('%Y-%m-%d %H:%M:%f')
+        cmd = f"""UPDATE {table_name} SET {self._mark_clause(table_name)}
     WHERE id = {id_};"""
-        self._exec(table_name, cmd, id_=id_)
+        self._exec(table_name, cmd, id_=id_,
+                   params=(self._now(table_name), ))
+
+    def _timestamp_ids(self, table_name, ids):
+        """Set the same timestamp to all entries matching ids."""
+        now = self._now(table_name)
+        marks = self._mark_clause(table_name)
+        with self._savepoint('timestamp_ids'):
+            for i in range(0, len(ids), IDS_CHUNK):
+                chunk = ids[i:i + IDS_CHUNK]
+                qmarks = ', '.join('?' * len(chunk))
+                self.cursor.execute(f'UPDATE {table_name} SET {marks} '
+                                    f'WHERE id IN ({qmarks});', [now] + chunk)
 
     def _reset(self, table_name, n):
         """Reset the n oldest timestamped entries."""
-        cmd = f"""UPDATE {table_name} SET timestamp=0
-    WHERE id IN (SELECT id FROM {table_name} WHERE timestamp != 0
+        if self._has_generations(table_name):
+            generation = self._generation(table_name)
+            cmd = f"""UPDATE {table_name} SET generation=0
+    WHERE id IN (SELECT id FROM {table_name} WHERE generation = {generation}
+    ORDER BY timestamp LIMIT {n});"""
+        else:
+            # (timestamp > 0 rather than != 0, so that an index on
+            # timestamps can be searched instead of scanned; text timestamps
+            # are always greater than 0)
+            cmd = f"""UPDATE {table_name} SET timestamp=0
+    WHERE id IN (SELECT id FROM {table_name} WHERE timestamp > 0
     ORDER BY timestamp LIMIT {n});"""
         self._exec(table_name, cmd)
 
     def _full_reset(self, table_name):
-        """Reset all entries."""
-        self._reset(table_name, self.get_rows_nb(table_name))
+        """
+        Reset all entries. If the table has generations, only its generation
+        counter is incremented.
+        """
+        if self._has_generations(table_name):
+            self._set_generation(table_name,
+                                 self._generation(table_name) + 1)
+            if self._counters(table_name) is not None:
+                # All rows are older than the new generation
+                self._exec(None, f'UPDATE {COUNTERS_TABLE} '
+                           f'SET free_nb = rows_nb WHERE table_name=?;',
+                           params=(table_name, ))
+        else:
+            self._reset(table_name, self.get_rows_nb(table_name))
 
-    def draw_rows(self, table_name, n, oldest_prevail=False):
-        """Return n rows, randomly chosen."""
+    def _assert_enough_rows(self, table_name, n):
+        """Raise an exception if the table contains less than n rows."""
         rows_nb = self.get_rows_nb(table_name)
         if n > rows_nb:
             raise ValueError(f'{n} rows are required from "{table_name}", '
                              f'but it only contains {rows_nb} rows.')
-        timestamps_clause = ''
+        return True
+
+    def _draw_ids(self, table_name, n, where_clause, first, last,
+                  candidates_nb, rng):
+        """
+        Randomly choose n ids among the candidates_nb rows matching
+        where_clause, whose ids lie in first..last.
+
+        If the candidates are numerous enough (compared to the ids' range
+        and to n), random ids are drawn and kept if they match where_clause.
+        Otherwise all candidates' ids are read once, through a reservoir.
+        """
+        span = last - first + 1
+        if candidates_nb * SPARSE_RATIO < span \
+                or n * SPARSE_RATIO > candidates_nb:
+            cmd = f'SELECT id FROM {table_name} WHERE {where_clause} '\
+                f'ORDER BY id;'
+            return reservoir_sample((row[0] for row in self._iter_fetch(cmd)),
+                                    n, rng=rng)
+        drawn = []
+        tried = set()
+        while len(drawn) < n and len(tried) < span:
+            wanted = (n - len(drawn)) * SPARSE_RATIO
+            batch = []
+            while len(batch) < min(wanted, IDS_CHUNK) and len(tried) < span:
+                id_ = rng.randint(first, last)
+                if id_ not in tried:
+                    tried.add(id_)
+                    batch.append(id_)
+            qmarks = ', '.join('?' * len(batch))
+            cmd = f'SELECT id FROM {table_name} WHERE id IN ({qmarks}) '\
+                f'AND {where_clause};'
+            found = {row[0] for row in self.cursor.execute(cmd, batch)}
+            drawn.extend(id_ for id_ in batch if id_ in found)
+        return drawn[:n]
+
+    def _prepare_draw(self, table_name, n, oldest_prevail):
+        """
+        Check n rows can be drawn from the table and, if oldest_prevail,
+        reset enough timestamped rows.
+
+        Return the first and last ids, the clause matching the candidates
+        (None if all rows are candidates) and the number of candidates.
+        """
+        first, last = self._id_bounds(table_name)
+        if first is None:
+            first, last = 1, 0
+        span = last - first + 1
+        if n > span:
+            self._assert_enough_rows(table_name, n)
+        where_clause = None
+        candidates_nb = span
         if oldest_prevail:  # If timestamps must be taken into account
-            cmd = f'SELECT COUNT(*) FROM {table_name} WHERE timestamp=0;'
-            free_nb = tuple(self._exec(table_name, cmd))[0][0]
+            free_clause = self._free_clause(table_name)
+            counters = self._counters(table_name)
+            if counters is not None:
+                free_nb = counters[1]
+            else:
+                cmd = f'SELECT COUNT(*) FROM {table_name} '\
+                    f'WHERE {free_clause};'
+                free_nb = tuple(self._exec(table_name, cmd))[0][0]
             if n > free_nb:
+                self._assert_enough_rows(table_name, n)
                 self._reset(table_name, n - free_nb)
-            timestamps_clause = 'WHERE timestamp=0 '
-        cols_list = ','.join(self.get_cols(table_name))
-        cmd = f'SELECT {cols_list} FROM {table_name} {timestamps_clause}'\
-            f'ORDER BY random() LIMIT {n};'
-        rows = self._exec(table_name, cmd).fetchall()
+                where_clause = free_clause
+                candidates_nb = n
+            elif free_nb < span:
+                where_clause = free_clause
+                candidates_nb = free_nb
+        return (first, last, where_clause, candidates_nb)
+
+    def _existing_candidates(self, table_name, n):
+        """
+        Return the clause matching all rows, and their number, to draw n rows
+        among the existing ids (when they are not contiguous).
+        """
+        self._assert_enough_rows(table_name, n)
+        return ('1', self.get_rows_nb(table_name))
+
+    def draw_rows(self, table_name, n, oldest_prevail=False, seed=None,
+                  rng=None):
+        """
+        Return n rows, randomly chosen.
+
+        As long as all rows are candidates, ids are drawn from the ids' range
+        (that is contiguous) and only the matching rows are fetched. If only
+        the rows not timestamped are candidates, the ids are drawn among
+        theirs.
+
+        The draw is reproducible if a seed or a random.Random instance (rng)
+        is provided.
+        """
+        return self._draw(table_name, n, oldest_prevail,
+                          _get_rng(seed, rng))[1]
+
+    def _draw(self, table_name, n, oldest_prevail, rng):
+        """Randomly choose n rows. Return their ids and the rows."""
+        first, last, where_clause, candidates_nb = \
+            self._prepare_draw(table_name, n, oldest_prevail)
+        cols = self.get_cols(table_name)
+        if where_clause is None:
+            ids = rng.sample(range(first, last + 1), n)
+            rows = self._fetch_by_ids(table_name, cols, ids)
+            if len(rows) == n:
+                return (ids, rows)
+            where_clause, candidates_nb = \
+                self._existing_candidates(table_name, n)
+        ids = self._draw_ids(table_name, n, where_clause, first, last,
+                             candidates_nb, rng)
+        return (ids, self._fetch_by_ids(table_name, cols, ids))
+
+    def draw_and_mark(self, table_name, n, oldest_prevail=True, seed=None,
+                      rng=None):
+        """
+        Return n rows, randomly chosen, after having timestamped them.
+
+        Drawing and timestamping take place in a single transaction, and
+        all rows are timestamped at once.
+        """
+        with self._savepoint('draw_and_mark'):
+            ids, rows = self._draw(table_name, n, oldest_prevail,
+                                   _get_rng(seed, rng))
+            self._timestamp_ids(table_name, ids)
         return rows
+
+    def draw_batches(self, table_name, n, k, oldest_prevail=False,
+                     seed=None, rng=None):
+        """
+        Return k lists of n rows, randomly chosen.
+
+        All draws are made from the same snapshot of the candidates' ids
+        (the ids' range if all rows are candidates, an array of the
+        candidates' ids otherwise), and the rows are fetched all at once.
+        """
+        rng = _get_rng(seed, rng)
+        first, last, where_clause, _ = \
+            self._prepare_draw(table_name, n, oldest_prevail)
+        cols = self.get_cols(table_name)
+        population = range(first, last + 1)
+        while True:
+            if where_clause is not None:
+                cmd = f'SELECT id FROM {table_name} WHERE {where_clause} '\
+                    f'ORDER BY id;'
+                population = array('q', (row[0]
+                                         for row in self._iter_fetch(cmd)))
+            draws = [rng.sample(population, n) for _ in range(k)]
+            found = self._rows_by_ids(table_name, cols,
+                                      sorted(set(itertools.chain(*draws))))
+            if all(id_ in found for draw in draws for id_ in draw):
+                return [[found[id_] for id_ in draw] for draw in draws]
+            where_clause, _ = self._existing_candidates(table_name, n)
+
+
+class Table:
+    """
+    Lazy view of a table, that reads rows only when they are needed.
+
+    The view behaves like a sequence of rows (made of the cols, by default
+    the same columns as get_cols()), in the order of their ids:
+    - len() counts the rows (the count is kept until the database changes)
+    - view[i] and view[i:j:k] read only the rows requested, by ids (the
+      ids of the rows are contiguous, starting from 1)
+    - iterating over the view, or over reversed(view), reads the rows page
+      by page (page_size rows at a time), each page starting after the last
+      id of the previous one (rather than using OFFSET, that would read
+      all the skipped rows again), so that the memory used and the time to
+      get each page do not depend on the size of the table.
+    select() returns a view of other columns of the same table.
+    """
+    def __init__(self, operator, name, cols=None, page_size=None):
+        self.operator = operator
+        self.name = name
+        if cols is None:
+            cols = operator.get_cols(name)
+        available = ['id'] + operator._stored_cols(name)
+        for col in cols:
+            if col not in available:
+                raise ValueError(f'In database, cannot find a column named '
+                                 f'"{col}" in table "{name}"')
+        self.cols = list(cols)
+        self.page_size = page_size or BATCH_SIZE
+        self._len = None
+        self._len_token = None
+
+    def select(self, *cols):
+        """Return a view of the cols of the same table."""
+        return Table(self.operator, self.name, cols=cols,
+                     page_size=self.page_size)
+
+    def __len__(self):
+        token = self.operator._data_token()
+        if token != self._len_token:
+            self._len = self.operator.get_rows_nb(self.name)
+            self._len_token = token
+        return self._len
+
+    def _query(self, where, params, order='', limit=''):
+        """Return the rows of the cols (preceded by the id) matching where."""
+        cmd = f'SELECT id, {", ".join(self.cols)} FROM {self.name} '\
+            f'WHERE {where}{order}{limit};'
+        return self.operator.cursor.connection.execute(cmd, params)\
+            .fetchall()
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            indices = range(*key.indices(len(self)))
+            if not indices:
+                return []
+            where = 'id BETWEEN ? AND ?'
+            params = [min(indices) + 1, max(indices) + 1]
+            if abs(indices.step) != 1:
+                where += ' AND (id - ?) % ? = 0'
+                params += [indices.start + 1, abs(indices.step)]
+            order = ' ORDER BY id DESC' if indices.step < 0 else ' ORDER BY id'
+            return [row[1:] for row in self._query(where, params, order)]
+        if key < 0:
+            key += len(self)
+        rows = self._query('id = ?', (key + 1, )) if key >= 0 else []
+        if not rows:
+            raise IndexError(f'In table {self.name}, cannot find a row '
+                             f'number {key}')
+        return rows[0][1:]
+
+    def pages(self, backward=False):
+        """
+        Iterate over the pages of rows (lists of at most page_size rows), in
+        the order of the ids (reversed, if backward).
+        """
+        if backward:
+            where, order, last = 'id < ?', ' ORDER BY id DESC', MAX_ID
+        else:
+            where, order, last = 'id > ?', ' ORDER BY id', 0
+        while True:
+            rows = self._query(where, (last, ), order,
+                               f' LIMIT {self.page_size}')
+            if not rows:
+                return
+            yield [row[1:] for row in rows]
+            if len(rows) < self.page_size:
+                return
+            last = rows[-1][0]
+
+    def __iter__(self):
+        return itertools.chain.from_iterable(self.pages())
+
+    def __reversed__(self):
+        return itertools.chain.from_iterable(self.pages(backward=True))
+
+
+class AsyncCursor:
+    """
+    A cursor along with the thread it must be used from.
+
+    The calls passed to run() are queued and executed one at a time, in
+    their order of arrival, by the dedicated thread.
+    """
+    def __init__(self, cursor, executor):
+        self.cursor = cursor
+        self.executor = executor
+        self.lock = threading.Lock()
+        self._running = None
+
+    def _call(self, token, function, args, kwargs):
+        with self.lock:
+            self._running = token
+        try:
+            return function(*args, **kwargs)
+        except sqlite3.Error:
+            # The failure (an interruption, for instance) may have rolled
+            # the transaction back, along with the schema's changes
+            schema_cache = getattr(self.cursor.connection, 'schema_cache',
+                                   None)
+            if schema_cache is not None:
+                schema_cache.invalidate()
+            raise
+        finally:
+            with self.lock:
+                self._running = None
+
+    async def run(self, function, *args, **kwargs):
+        """
+        Run function(*args, **kwargs) in the dedicated thread and return its
+        result.
+
+        If the awaiting task is cancelled, the call is dropped if it is still
+        queued. If it is running, the statement being executed is
+        interrupted (its exception is then lost, along with its result; note
+        that SQLite rolls back the whole transaction if this statement was
+        writing).
+        """
+        token = object()
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self.executor, self._call, token,
+                                      function, args, kwargs)
+        try:
+            return await future
+        except asyncio.CancelledError:
+            with self.lock:
+                if self._running is token:
+                    self.cursor.connection.interrupt()
+            raise
+
+
+class AsyncRows:
+    """
+    Asynchronous iterator over the rows yielded by an iterator that must be
+    consumed from the thread of an AsyncCursor.
+    """
+    def __init__(self, async_cursor, rows, batch_size=None):
+        self.async_cursor = async_cursor
+        self.rows = rows
+        self.batch_size = batch_size or BATCH_SIZE
+        self.batch = []
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self.batch:
+            self.batch = await self.async_cursor.run(
+                lambda: list(itertools.islice(self.rows, self.batch_size)))
+            self.batch.reverse()
+        if not self.batch:
+            raise StopAsyncIteration
+        return self.batch.pop()
+
+
+class AsyncOperator:
+    """
+    Asynchronous front-end of an Operator, for use in asyncio code, along
+    with the AsyncContextManager:
+
+    async with microlib.database.AsyncContextManager(PATH_TO_DB) as cursor:
+        mydb = microlib.database.AsyncOperator(cursor)
+        rows = await mydb.get_table('table1')
+
+    All Operator's methods are available, as coroutines having the same
+    arguments and results, except that the methods returning an iterator
+    (like iter_table()) return an asynchronous iterator instead. They are
+    all run, one at a time, in the thread dedicated to the connection.
+    Keyword arguments are passed to the Operator.
+
+    The methods listed in unavailable are not: table() returns a view that
+    reads rows whenever it is used (len(), indexing, iteration), which only
+    the connection's thread can do. Use get_rows() or iter_table() instead.
+    """
+    operator_class = Operator
+    unavailable = ('table', )
+
+    def __init__(self, async_cursor, **kwargs):
+        self.async_cursor = async_cursor
+        self.operator = self.operator_class(async_cursor.cursor, **kwargs)
+
+    def __getattr__(self, name):
+        if name in self.unavailable:
+            raise AttributeError(f'In database, {type(self).__name__} '
+                                 f'cannot provide {name}(), that needs the '
+                                 f'connection\'s thread.')
+        attribute = getattr(self.operator, name)
+        if not callable(attribute):
+            return attribute
+
+        @functools.wraps(attribute)
+        async def method(*args, **kwargs):
+            result = await self.async_cursor.run(attribute, *args, **kwargs)
+            if isinstance(result, Iterator):
+                return AsyncRows(self.async_cursor, result,
+                                 batch_size=kwargs.get('batch_size'))
+            return result
+        return method
+
+
+class AsyncTsOperator(AsyncOperator):
+    """Asynchronous front-end of a Ts_Operator (see AsyncOperator)."""
+    operator_class = Ts_Operator
+
+
+class AsyncContextManager:
+    """
+    Asynchronous version of the ContextManager, that takes the same
+    arguments.
+
+    The connection is opened, used and closed by a thread dedicated to it,
+    so that the event loop is never blocked by SQLite. The object returned
+    at enter is an AsyncCursor, to give to AsyncOperators.
+    """
+    def __init__(self, path, **kwargs):
+        self.manager = ContextManager(path, **kwargs)
+        self.async_cursor = None
+
+    @property
+    def report(self):
+        return self.manager.report
+
+    async def __aenter__(self):
+        executor = ThreadPoolExecutor(max_workers=1,
+                                      thread_name_prefix='microlib-db')
+        loop = asyncio.get_running_loop()
+        try:
+            cursor = await loop.run_in_executor(executor,
+                                                self.manager.__enter__)
+        except BaseException:
+            executor.shutdown(wait=False)
+            raise
+        self.async_cursor = AsyncCursor(cursor, executor)
+        return self.async_cursor
+
+    async def __aexit__(self, exc_class, exc, traceback):
+        try:
+            await self.async_cursor.run(self.manager.__exit__, exc_class, exc,
+                                        traceback)
+        finally:
+            self.async_cursor.executor.shutdown(wait=False)
+
+
+class WriteQueue:
+    """
+    Funnel the write operations of many threads into a single connection,
+    grouping them into few transactions.
+
+    Any method of the Operator (an operator_class instance, built on the
+    queue's connection with the operator_kwargs) can be called on the
+    queue: the call is queued and a concurrent.futures.Future is returned
+    at once, that gets the method's result, or exception, once the call
+    has been run and committed.
+
+    with WriteQueue(PATH_TO_DB) as writer:
+        future = writer.insert_rows('table1', rows)
+        ...
+        future.result()
+
+    A thread runs the calls, in their order of arrival, by groups of at
+    most max_batch calls, each group in one transaction (started by BEGIN
+    IMMEDIATE and committed at once). A group ends as soon as no call is
+    waiting (a lone call is run at once, the calls arriving meanwhile
+    making the next group), or when max_delay seconds have passed since
+    its first call was taken. Each call runs in a savepoint of its own, so
+    that a failing call does not affect the other ones. The calls must not
+    commit by themselves (insert_rows()' commit_every is refused, for
+    instance). batches and calls count the groups and the calls run (the
+    cancelled ones are not).
+
+    retry is given to the ContextManager; BEGIN IMMEDIATE and the commits
+    are then retried when the database is locked.
+    """
+    def __init__(self, path, operator_class=None, max_batch=100,
+                 max_delay=0.01, pragmas=None, retry=None, **operator_kwargs):
+        self.path = path
+        self.retry = retry
+        self.operator_class = operator_class or Operator
+        self.operator_kwargs = operator_kwargs
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.pragmas = pragmas
+        self.requests = queue.Queue()
+        self.batches = 0
+        self.calls = 0
+        self.thread = None
+
+    def start(self):
+        """Start the writing thread."""
+        self.thread = threading.Thread(target=self._work,
+                                       name='microlib-db-writer', daemon=True)
+        self.thread.start()
+
+    def close(self):
+        """Run the calls already queued, then stop the writing thread."""
+        if self.thread is not None:
+            self.requests.put(None)
+            self.thread.join()
+            self.thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_class, exc, traceback):
+        self.close()
+
+    def submit(self, name, *args, **kwargs):
+        """Queue the call of the Operator's method name. Return its Future."""
+        if self.thread is None:
+            raise ValueError('In database, cannot queue a call to a '
+                             'WriteQueue that is not started.')
+        future = Future()
+        self.requests.put((future, name, args, kwargs))
+        return future
+
+    def __getattr__(self, name):
+        if name.startswith('__') or not callable(
+                getattr(self.operator_class, name, None)):
+            raise AttributeError(name)
+        return functools.partial(self.submit, name)
+
+    def _next_batch(self):
+        """
+        Wait for a call and return it along with the following ones, as
+        described in the class' docstring. The end of the queue (None) is
+        returned as the last element.
+        """
+        batch = [self.requests.get()]
+        deadline = time.monotonic() + self.max_delay
+        while batch[-1] is not None and len(batch) < self.max_batch \
+                and time.monotonic() < deadline:
+            try:
+                batch.append(self.requests.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _fail(self, batch, exc):
+        """Set exc as the exception of the calls of batch."""
+        for future, *_ in batch:
+            if future.set_running_or_notify_cancel():
+                future.set_exception(exc)
+
+    def _run_batch(self, db, batch):
+        """Run the calls of batch in a single transaction."""
+        conn = db.cursor.connection
+        policy = conn.retry_policy
+        try:
+            if policy is None:
+                conn.execute('BEGIN IMMEDIATE;')
+            else:
+                policy.run(conn.execute, 'BEGIN IMMEDIATE;')
+        except sqlite3.Error as exc:
+            self._fail(batch, exc)
+            return
+        done = []
+        ran = 0
+        for future, name, args, kwargs in batch:
+            if not future.set_running_or_notify_cancel():
+                continue
+            ran += 1
+            try:
+                with db._savepoint('write_queue'):
+                    result = getattr(db, name)(*args, **kwargs)
+            except Exception as exc:
+                future.set_exception(exc)
+            else:
+                done.append((future, result))
+        try:
+            if policy is None:
+                conn.commit()
+            else:
+                policy.run(conn.commit)
+        except Exception as exc:
+            conn.rollback()
+            for future, _ in done:
+                future.set_exception(exc)
+        else:
+            for future, result in done:
+                future.set_result(result)
+        self.batches += 1
+        self.calls += ran
+
+    def _serve(self, db, error=None):
+        """
+        Run the queued calls on db (or, if error is given, make them fail)
+        until the queue is closed.
+        """
+        while True:
+            batch = self._next_batch()
+            end = batch[-1] is None
+            if end:
+                batch.pop()
+            if batch and error is None:
+                self._run_batch(db, batch)
+            elif batch:
+                self._fail(batch, error)
+            if end:
+                return True
+
+    def _work(self):
+        ended = False
+        try:
+            with ContextManager(self.path, pragmas=self.pragmas,
+                                retry=self.retry) as cursor:
+                db = self.operator_class(cursor, **self.operator_kwargs)
+                ended = self._serve(db)
+        except Exception as exc:
+            # The connection is not usable: all calls fail, until close()
+            if not ended:
+                self._serve(None, error=exc)
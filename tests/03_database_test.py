@@ -19,13 +19,27 @@
 # along with Microlib; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
 
+import io
+import time
+import threading
+import asyncio
+import shutil
+import random
 import sqlite3
 from pathlib import Path
+from contextlib import closing
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 
 import pytest
 
 from microlib.database import ContextManager, Operator, intspan2sqllist
-from microlib.database import Ts_Operator
+from microlib.database import Ts_Operator, ConnectionPool, connect
+from microlib.database import PERFORMANCE_PRAGMAS, reservoir_sample
+from microlib.database import Instrumentation, statement_template
+from microlib.database import TEMPLATES, AsyncContextManager
+from microlib.database import AsyncOperator, AsyncTsOperator, WriteQueue
+from microlib.database import RetryPolicy, FORMATS
 
 TESTDB_PATH = Path(__file__).parent / 'data/test.db'
 TESTDB_TS_PATH = Path(__file__).parent / 'data/test_with_ts.db'
@@ -36,6 +50,15 @@ def test_intspan2sqllist():
         '(1, 2, 3, 14, 29, 92, 93, 94, 95, 96, 97)'
 
 
+def test_reservoir_sample():
+    assert reservoir_sample([], 2) == []
+    assert reservoir_sample(range(10), 0) == []
+    assert sorted(reservoir_sample(range(3), 5)) == [0, 1, 2]
+    sample = reservoir_sample(iter(range(1000)), 10)
+    assert len(set(sample)) == 10
+    assert all(0 <= n < 1000 for n in sample)
+
+
 def test_ContextManager():
     with ContextManager(':memory:') as cursor:
         cmd = """CREATE TABLE test1
@@ -48,6 +71,72 @@ def test_ContextManager():
     assert str(excinfo.value) == 'Cannot operate on a closed cursor.'
 
 
+def test_connect(tmp_path):
+    conn = connect(tmp_path / 'test.db', pragmas=PERFORMANCE_PRAGMAS)
+    assert conn.execute('PRAGMA journal_mode;').fetchone()[0] == 'wal'
+    assert conn.execute('PRAGMA busy_timeout;').fetchone()[0] == 5000
+    conn.close()
+    with pytest.raises(ValueError) as excinfo:
+        connect(':memory:', pragmas={'user_version': 3})
+    assert str(excinfo.value) == 'In database, cannot set pragma '\
+        '"user_version" (only journal_mode, synchronous, cache_size, '\
+        'mmap_size, temp_store, busy_timeout can be set).'
+    with pytest.raises(ValueError) as excinfo:
+        connect(':memory:', pragmas={'synchronous': 'OFF; DROP TABLE t'})
+    assert str(excinfo.value) == 'In database, invalid value '\
+        '"OFF; DROP TABLE t" for pragma "synchronous".'
+
+
+def test_ContextManager_pool(tmp_path):
+    pool = ConnectionPool()
+    path = tmp_path / 'test.db'
+    with ContextManager(path, pool=pool, pragmas={'cache_size': -1000}) \
+            as cursor:
+        conn = cursor.connection
+        Operator(cursor).create_table('table1', ['col1'], [('a', )])
+    with ContextManager(path, pool=pool) as cursor:
+        assert cursor.connection is conn
+        assert cursor.execute('PRAGMA cache_size;').fetchone()[0] == -1000
+        Operator(cursor).insert_rows('table1', [('b', )])
+    with ContextManager(path, testing=True, pool=pool) as cursor:
+        db = Operator(cursor)
+        db.insert_rows('table1', [('c', )])
+        db.create_table('table2', ['col1'])
+    assert not conn.in_transaction
+    with ContextManager(path) as cursor:
+        db = Operator(cursor)
+        assert db.list_tables() == ['table1']
+        assert db.get_table('table1') == [('1', 'a'), ('2', 'b')]
+    pool.close()
+    with pytest.raises(sqlite3.ProgrammingError):
+        conn.execute('SELECT 1;')
+
+
+def test_ContextManager_failed_commit(tmp_path):
+    pool = ConnectionPool()
+    path = tmp_path / 'test.db'
+    shutil.copy(TESTDB_PATH, path)
+    with closing(sqlite3.connect(str(path), isolation_level=None)) as reader:
+        with pytest.raises(sqlite3.OperationalError) as excinfo:
+            with ContextManager(path, pool=pool,
+                                pragmas={'busy_timeout': 0}) as cursor:
+                conn = cursor.connection
+                Operator(cursor).insert_rows('table1', [('a', 'b')])
+                # A pending read prevents the commit
+                reader.execute('BEGIN;')
+                reader.execute('SELECT * FROM table1;').fetchall()
+        assert str(excinfo.value) == 'database is locked'
+        reader.execute('COMMIT;')
+    with pytest.raises(sqlite3.ProgrammingError):
+        conn.execute('SELECT 1;')
+    with ContextManager(path, pool=pool) as cursor:
+        assert cursor.connection is not conn
+        assert Operator(cursor).get_rows_nb('table1') == 4
+    with ContextManager(path, pool=pool) as cursor:
+        assert Operator(cursor).get_rows_nb('table1') == 4
+    pool.close()
+
+
 def test_list_tables():
     with ContextManager(TESTDB_PATH) as cursor:
         db = Operator(cursor)
@@ -101,6 +190,337 @@ def test_get_cols_TS():
                                                           'col3']
 
 
+def test_schema_cache():
+    with ContextManager(TESTDB_PATH, testing=True) as cursor:
+        db = Operator(cursor)
+        assert Operator(cursor).schema_cache is db.schema_cache
+        assert db.get_cols('table1') == ['col1', 'col2']
+        assert db.schema_cache.tables == ['table1', 'table2']
+        assert 'table1' in db.schema_cache.columns
+        cursor.execute('ALTER TABLE table1 ADD COLUMN col3 TEXT;')
+        assert db.get_cols('table1') == ['col1', 'col2', 'col3']
+        db.create_table('table3', ['col1'])
+        assert db.schema_cache.tables is None
+        assert db.list_tables() == ['table1', 'table2', 'table3']
+        db.rename_table('table3', 'table4')
+        assert db.list_tables() == ['table1', 'table2', 'table4']
+    with sqlite3.connect(':memory:') as conn:
+        db = Operator(conn.cursor())
+        db.create_table('table1', ['col1'])
+        assert db.get_cols('table1') == ['col1']
+
+
+def test_schema_cache_rollback(tmp_path):
+    with closing(connect(tmp_path / 'test.db')) as conn:
+        db = Operator(conn.cursor())
+        db.create_table('a', ['col1'])
+        conn.commit()
+        conn.execute('BEGIN;')
+        conn.execute('CREATE TABLE b (col1 TEXT);')
+        assert db.list_tables() == ['a', 'b']
+        conn.rollback()
+        # schema_version is now back to its value before b, and c brings it
+        # to the value cached along with b
+        with closing(sqlite3.connect(str(tmp_path / 'test.db'))) as other:
+            other.execute('CREATE TABLE c (col1 TEXT);')
+            other.commit()
+        assert db.list_tables() == ['a', 'c']
+
+
+def test_indexes():
+    with ContextManager(TESTDB_PATH, testing=True) as cursor:
+        db = Operator(cursor)
+        assert db.list_indexes('table2') == []
+        assert db.create_index('table2', ['col1', 'col2']) \
+            == 'table2_col1_col2_idx'
+        db.create_index('table2', ['col3'], name='table2_french',
+                        unique=True, where='col3 != ""', include=['col1'])
+        db.create_index('table2', ['col2'], name='other_name')
+        assert db.list_indexes('table2') \
+            == ['table2_col1_col2_idx', 'table2_french', 'other_name']
+        plan = cursor.execute('EXPLAIN QUERY PLAN SELECT col1 FROM table2 '
+                              'WHERE col3 = "faire" AND col3 != "";')\
+            .fetchall()
+        assert 'COVERING INDEX table2_french' in plan[0][3]
+        with pytest.raises(sqlite3.IntegrityError):
+            db.insert_rows('table2', [('do', 'b', 'faire')])
+        with pytest.raises(ValueError) as excinfo:
+            db.create_index('table2', ['col4'])
+        assert str(excinfo.value) == 'In database, cannot find a column '\
+            'named "col4" in table "table2"'
+        statements = []
+        cursor.connection.set_trace_callback(statements.append)
+        db.sort_table('table2', 3)
+        cursor.connection.set_trace_callback(None)
+        assert db.list_indexes('table2') \
+            == ['table2_col1_col2_idx', 'table2_french', 'other_name']
+        assert len([s for s in statements if 'CREATE ' in s
+                    and 'INDEX' in s]) == 3
+        db.copy_table('table2', 'table3')
+        assert db.list_indexes('table3') \
+            == ['table3_col1_col2_idx', 'table3_french', 'table3_other_name']
+        db.copy_table('table2', 'table5', indexes=False)
+        assert db.list_indexes('table5') == []
+        cursor.execute('DELETE FROM table2 WHERE id = 2;')
+        db._reset_table_ids('table2')
+        assert db.list_indexes('table2') \
+            == ['table2_col1_col2_idx', 'table2_french', 'other_name']
+        statements = []
+        cursor.connection.set_trace_callback(statements.append)
+        db.rename_table('table2', 'table4')
+        cursor.connection.set_trace_callback(None)
+        assert not any('INDEX' in s for s in statements)
+        assert db.list_indexes('table4') \
+            == ['table2_col1_col2_idx', 'table2_french', 'other_name']
+        db.drop_index('table2_french')
+        assert db.list_indexes('table4') \
+            == ['table2_col1_col2_idx', 'other_name']
+        with pytest.raises(ValueError) as excinfo:
+            db.drop_index('table2_french')
+        assert str(excinfo.value) == 'In database, cannot find an index '\
+            'named "table2_french"'
+
+
+def test_result_cache(tmp_path):
+    with ContextManager(TESTDB_PATH, testing=True) as cursor:
+        db = Operator(cursor, cache_size=2)
+        assert db.get_table('table1') == db.get_table('table1')
+        assert db.result_cache.hits == 1
+        table = db.get_table('table1')
+        table.append('something')
+        assert len(db.get_table('table1')) == 4
+        db.get_rows_nb('table2')
+        db.get_rows(['col1'], 'table2', 'id < 3')
+        assert len(db.result_cache.results) == 2
+        assert db.get_rows(['col1'], 'table2', 'id < 3') \
+            == [('begin', ), ('break', )]
+        db.update_table('table2', 2, ['bring', 'brought, brought', 'apporter'])
+        assert db.get_rows(['col1'], 'table2', 'id < 3') \
+            == [('begin', ), ('bring', )]
+        db.get_table('table2')
+        with pytest.raises(ValueError):
+            with db._savepoint('test'):
+                db.remove_row('table2', 1)
+                assert db.get_rows_nb('table2') == 3
+                raise ValueError
+        assert db.get_rows_nb('table2') == 4
+    path = tmp_path / 'test.db'
+    with ContextManager(path) as cursor:
+        Operator(cursor).create_table('t', ['a'], content=[('x', )])
+    with ContextManager(path) as cursor1:
+        db = Operator(cursor1, cache_size=8)
+        assert db.get_table('t') == [('1', 'x')]
+        with ContextManager(path) as cursor2:
+            Operator(cursor2).insert_rows('t', [('y', )])
+        assert db.get_table('t') == [('1', 'x'), ('2', 'y')]
+        misses = db.result_cache.misses
+        db.get_table('t')
+        assert db.result_cache.misses == misses
+
+
+def test_statement_template():
+    assert statement_template("SELECT a FROM t1  WHERE id IN (1, 2, 3)\n"
+                              "AND b = 'it''s' AND c > 2.5;") \
+        == 'SELECT a FROM t1 WHERE id IN (?, ...) AND b = ? AND c > ?'
+
+
+def test_instrumentation():
+    cm = ContextManager(TESTDB_PATH, testing=True,
+                        instrumentation=Instrumentation(slow_threshold=0,
+                                                        explain=True))
+    with cm as cursor:
+        db = Operator(cursor)
+        db.get_table('table1')
+        db.update_rows('table2', {1: ['a', 'b', 'c'], 2: ['d', 'e', 'f']})
+        db.get_rows(['col1'], 'table2', 'id = 3')
+        assert cursor.connection.instrumentation is cm.instrumentation
+    instrumentation = cm.instrumentation
+    assert cursor.connection.instrumentation is None
+    update = instrumentation.statements[
+        'UPDATE table2 SET col1=?, col2=?, col3=? WHERE id=?']
+    assert (update.executions, update.calls, update.rows) == (2, 1, 2)
+    assert sum(update.histogram.values()) == 1
+    assert instrumentation.operations['PRAGMA'].calls >= 1
+    assert instrumentation.operations['SELECT'].executions \
+        == instrumentation.operations['SELECT'].calls
+    assert 'SELECT col1 FROM table2 WHERE id = ?' \
+        in instrumentation.statements
+    plans = {sql: plan for _, sql, plan in instrumentation.slow_queries}
+    assert plans['SELECT col1 FROM table2 WHERE id = 3;'] \
+        == ['SEARCH table2 USING INTEGER PRIMARY KEY (rowid=?)']
+    assert plans['SAVEPOINT starttest;'] is None
+    assert 'Slow statements:' in cm.report
+    assert cm.report.startswith(' operation | executions | calls |')
+    with ContextManager(TESTDB_PATH, testing=True) as cursor:
+        assert type(cursor) is sqlite3.Cursor
+
+
+def test_ContextManager_in_memory(tmp_path):
+    path = tmp_path / 'test.db'
+    shutil.copy(TESTDB_PATH, path)
+
+    def table1_rows_nb():
+        with closing(sqlite3.connect(str(path))) as conn:
+            return conn.execute('SELECT COUNT(*) FROM table1;').fetchone()[0]
+
+    cm = ContextManager(path, in_memory=True, flush_interval=3600)
+    with cm as cursor:
+        assert cursor.connection.execute('PRAGMA database_list;')\
+            .fetchone()[2] == ''
+        db = Operator(cursor)
+        assert db.get_rows_nb('table1') == 4
+        db.insert_rows('table1', [('a', 'b')])
+        cursor.connection.commit()
+        assert table1_rows_nb() == 4
+    assert table1_rows_nb() == 5
+    assert cm.replica.flushes == 1
+    cm = ContextManager(path, in_memory=True)
+    with cm as cursor:
+        db = Operator(cursor)
+        db.insert_rows('table1', [('c', 'd')], commit_every=1)
+        assert table1_rows_nb() == 6
+        db.get_table('table1')
+    assert cm.replica.flushes == 1
+    with ContextManager(path, testing=True, in_memory=True) as cursor:
+        db = Operator(cursor)
+        db.insert_rows('table1', [('e', 'f')])
+        assert db.get_rows_nb('table1') == 7
+    assert table1_rows_nb() == 6
+    with pytest.raises(ValueError) as excinfo:
+        ContextManager(path, in_memory=True, pool=ConnectionPool())
+    assert str(excinfo.value) == 'In database, cannot use a pool of '\
+        'connections along with an in-memory copy of the database.'
+
+
+def test_ContextManager_templates(tmp_path):
+    path = tmp_path / 'test.db'
+    shutil.copy(TESTDB_PATH, path)
+    for i in range(2):
+        with ContextManager(path, testing=True, in_memory=True) as cursor:
+            db = Operator(cursor)
+            assert db.get_rows_nb('table1') == 4
+            db.insert_rows('table1', [('a', 'b')], commit_every=1)
+            db.remove_table('table2')
+        if i == 0:
+            # The file is not needed anymore
+            assert str(path.resolve()) in TEMPLATES.templates
+            path.unlink()
+    assert not path.exists()
+    TEMPLATES.clear()
+    assert TEMPLATES.templates == {}
+
+
+def test_table_view():
+    with ContextManager(TESTDB_TS_PATH, testing=True) as cursor:
+        db = Ts_Operator(cursor)
+        db.create_table('table3', ['col1', 'col2'],
+                        [(str(i), str(i * i)) for i in range(10)])
+        rows = [(str(i), str(i * i)) for i in range(10)]
+        view = db.table('table3', page_size=3)
+        assert len(view) == 10
+        assert list(view) == rows
+        assert list(reversed(view)) == rows[::-1]
+        assert [len(page) for page in view.pages()] == [3, 3, 3, 1]
+        for key in [slice(2, 5), slice(None, None, -1), slice(-3, None),
+                    slice(1, 9, 3), slice(8, 1, -2), slice(5, 2)]:
+            assert view[key] == rows[key]
+        assert view[0] == ('0', '0')
+        assert view[-1] == ('9', '81')
+        with pytest.raises(IndexError) as excinfo:
+            view[10]
+        assert str(excinfo.value) == 'In table table3, cannot find a row '\
+            'number 10'
+        with pytest.raises(IndexError):
+            view[-11]
+        assert view.select('id', 'timestamp')[3] == (4, 0)
+        with pytest.raises(ValueError) as excinfo:
+            view.select('col3')
+        assert str(excinfo.value) == 'In database, cannot find a column '\
+            'named "col3" in table "table3"'
+        statements = []
+        cursor.connection.set_trace_callback(statements.append)
+        len(view)
+        cursor.connection.set_trace_callback(None)
+        assert not any('COUNT' in s for s in statements)
+        db.remove_row('table3', 1)
+        assert len(view) == 9
+        assert view[0] == ('1', '1')
+
+
+@pytest.mark.parametrize('fmt,compress',
+                         [('csv', False), ('jsonl', False), ('csv', True),
+                          ('jsonl', True)])
+def test_export_import_table(fmt, compress):
+    with ContextManager(TESTDB_TS_PATH, testing=True) as cursor:
+        db = Ts_Operator(cursor)
+        db._timestamp('table2', 1)
+        fileobj = io.BytesIO() if compress else io.StringIO()
+        progress = []
+        assert db.export_table('table2', fileobj, fmt=fmt, compress=compress,
+                               progress=progress.append, batch_size=3) == 4
+        assert progress == [3, 4]
+        if not compress:
+            first = fileobj.getvalue().splitlines()[0]
+            assert first == {'csv': 'col1,col2,col3',
+                             'jsonl': '{"col1": "begin", '
+                             '"col2": "began, begun", '
+                             '"col3": "commencer"}'}[fmt]
+        fileobj.seek(0)
+        progress = []
+        assert db.import_table('table3', fileobj, fmt=fmt, compress=compress,
+                               progress=progress.append, batch_size=3) == 4
+        assert progress == [3, 4]
+        assert db.get_table('table3') == db.get_table('table2')
+        assert db.get_cols('table3') == ['col1', 'col2', 'col3']
+        assert cursor.execute('SELECT timestamp FROM table3;').fetchall() \
+            == [(0, )] * 4
+        fileobj.seek(0)
+        db.import_table('table3', fileobj, fmt=fmt, compress=compress)
+        assert db.get_rows_nb('table3') == 8
+        fileobj.seek(0)
+        with pytest.raises(ValueError) as excinfo:
+            db.import_table('table1', fileobj, fmt=fmt, compress=compress)
+        assert str(excinfo.value) == 'In database, cannot import columns '\
+            '[\'col1\', \'col2\', \'col3\'] into table "table1", whose '\
+            'columns are [\'col1\', \'col2\'].'
+
+
+def test_export_import_errors():
+    with ContextManager(TESTDB_PATH, testing=True) as cursor:
+        db = Operator(cursor)
+        with pytest.raises(ValueError) as excinfo:
+            db.export_table('table1', io.StringIO(), fmt='xml')
+        assert str(excinfo.value) == 'In database, cannot use the format '\
+            '"xml" (only csv, jsonl are available).'
+        assert db.import_table('table3', io.StringIO(''), fmt='jsonl') == 0
+        assert not db.table_exists('table3')
+        content = '{"col1": "a", "col2": "b"}\n\n{"col1": "c", "col3": "d"}\n'
+        with pytest.raises(ValueError) as excinfo:
+            db.import_table('table1', io.StringIO(content), fmt='jsonl')
+        assert str(excinfo.value) == 'In database, cannot import line 2 '\
+            'into table "table1": its keys [\'col1\', \'col3\'] do not '\
+            'match [\'col1\', \'col2\'].'
+        assert db.get_rows_nb('table1') == 4
+
+
+@pytest.mark.parametrize('fmt', FORMATS)
+def test_export_import_types(fmt):
+    with ContextManager(TESTDB_PATH, testing=True) as cursor:
+        db = Operator(cursor)
+        db.create_table('table3', ['col1', 'col2'],
+                        [(1, 'a'), (None, 'b')], col_types={'col1': 'INTEGER'})
+        fileobj = io.StringIO()
+        db.export_table('table3', fileobj, fmt=fmt)
+        col_types = dict(zip(db.get_cols('table3'),
+                             db.get_col_types('table3')))
+        fileobj.seek(0)
+        db.import_table('table4', fileobj, fmt=fmt, col_types=col_types)
+        assert db.get_col_types('table4') == ['INTEGER', 'TEXT']
+        # CSV loses the NULL values
+        assert cursor.execute('SELECT col1 FROM table4;').fetchall() \
+            == [(1, ), ('' if fmt == 'csv' else None, )]
+
+
 def test_get_rows_nb():
     with ContextManager(TESTDB_PATH) as cursor:
         db = Operator(cursor)
@@ -125,6 +545,36 @@ def test_drop_table():
         assert not db.table_exists('table2')
 
 
+def test_iter_rows():
+    with ContextManager(TESTDB_PATH) as cursor:
+        db = Operator(cursor)
+        rows = db.iter_rows(['col1'], 'table2', 'id > 1', batch_size=2)
+        assert next(rows) == ('break', )
+        assert db.get_rows_nb('table2') == 4
+        assert list(rows) == [('do', ), ('give', )]
+        with pytest.raises(ValueError) as excinfo:
+            db.iter_rows(['col1'], 'table3', 'id > 1')
+        assert str(excinfo.value) == \
+            'In database, cannot find a table named "table3"'
+
+
+def test_iter_table():
+    with ContextManager(TESTDB_PATH) as cursor:
+        db = Operator(cursor)
+        rows = db.iter_table('table2', include_headers=True, sort=3,
+                             batch_size=1)
+        assert next(rows) == ('id', 'col1', 'col2', 'col3')
+        assert next(rows) == ('2', 'break', 'broke, broken', 'casser')
+        assert list(rows) == [('1', 'begin', 'began, begun', 'commencer'),
+                              ('4', 'give', 'gave, given', 'donner'),
+                              ('3', 'do', 'did, done', 'faire')]
+        assert list(db.iter_table('table1')) == db.get_table('table1')
+        with pytest.raises(ValueError) as excinfo:
+            db.iter_table('table1', sort=3)
+        assert str(excinfo.value) == \
+            'In database, cannot find a column number 3 in table "table1"'
+
+
 def test_get_table():
     with ContextManager(TESTDB_PATH) as cursor:
         db = Operator(cursor)
@@ -282,6 +732,34 @@ def test_update_table_TS():
             "columns."
 
 
+def test_update_rows():
+    with ContextManager(TESTDB_PATH, testing=True) as cursor:
+        db = Operator(cursor)
+        db.update_rows('table1', {4: ['sol, "solis", m', 'col1'],
+                                  2: ('aqua, ae, f', "l'eau")})
+        assert db.get_table('table1') == \
+            [('1', 'adventus,  us, m.', 'arrivée'),
+             ('2', 'aqua, ae, f', "l'eau"),
+             ('3', 'candidus,  a, um', 'blanc'),
+             ('4', 'sol, "solis", m', 'col1')]
+        with pytest.raises(ValueError) as excinfo:
+            db.update_rows('table1', {1: ['a', 'b'], 5: ['c', 'd']})
+        assert str(excinfo.value) == \
+            'In database, cannot find a row number 5 in table "table1"'
+        with pytest.raises(ValueError) as excinfo:
+            db.update_rows('table3', {1: ['a', 'b']})
+        assert str(excinfo.value) == \
+            'In database, cannot find a table named "table3"'
+        assert db.get_table('table1')[0] == \
+            ('1', 'adventus,  us, m.', 'arrivée')
+        db.update_table('table1', db.get_table('table1')[2][0], ['a', 'b'])
+        assert db.get_table('table1')[2] == ('3', 'a', 'b')
+        with pytest.raises(ValueError) as excinfo:
+            db.update_rows('table1', {'x': ['a', 'b']})
+        assert str(excinfo.value) == 'In database, cannot use "x" as an id '\
+            '(ids are integers).'
+
+
 def test_original_name():
     with ContextManager(TESTDB_PATH, testing=True) as cursor:
         db = Operator(cursor)
@@ -371,6 +849,68 @@ def test_create_table_TS(mocker):
                 ]
 
 
+@dataclass
+class Verb:
+    infinitive: str
+    frequency: int
+    weight: float
+
+
+def test_create_table_typed():
+    with ContextManager(':memory:') as cursor:
+        db = Operator(cursor)
+        db.create_table('table1', ['word', 'rank'], [('b', 10), ('a', 9)],
+                        col_types={'rank': 'INTEGER'})
+        assert db.get_col_types('table1') == ['TEXT', 'INTEGER']
+        assert db.get_col_types('table1', include_id=True) \
+            == ['INTEGER', 'TEXT', 'INTEGER']
+        assert db.get_table('table1', sort=2) == [('2', 'a', 9),
+                                                  ('1', 'b', 10)]
+        db.sort_table('table1', 2)
+        assert db.get_table('table1') == [('1', 'a', 9), ('2', 'b', 10)]
+        assert db.get_col_types('table1') == ['TEXT', 'INTEGER']
+        with pytest.raises(ValueError) as excinfo:
+            db.create_table('table2', ['word'], col_types={'rank': 'INT'})
+        assert str(excinfo.value) == 'In database, cannot set the type of '\
+            'column "rank" that is not in [\'word\'].'
+        with pytest.raises(ValueError) as excinfo:
+            db.create_table('table2', ['word'],
+                            col_types={'word': 'TEXT); DROP TABLE table1;'})
+        assert str(excinfo.value) == 'In database, invalid type '\
+            '"TEXT); DROP TABLE table1;" for column "word".'
+        db.create_table('table2', ['word'], col_types={'word': 'VARCHAR(8)'})
+        assert db.get_col_types('table2') == ['VARCHAR(8)']
+
+
+def test_create_table_dataclass():
+    with ContextManager(':memory:') as cursor:
+        db = Ts_Operator(cursor)
+        db.create_table('verbs', Verb, [Verb('go', 3, 0.5), ('be', 1, 2.0)])
+        assert db.get_cols('verbs') == ['infinitive', 'frequency', 'weight']
+        assert db.get_col_types('verbs') == ['TEXT', 'INTEGER', 'REAL']
+        db.insert_rows('verbs', [Verb('do', 2, 1.5)])
+        assert db.get_table('verbs', sort=2) == [('2', 'be', 1, 2.0),
+                                                 ('3', 'do', 2, 1.5),
+                                                 ('1', 'go', 3, 0.5)]
+
+
+@pytest.mark.skipif(sqlite3.sqlite_version_info < (3, 37, 0),
+                    reason='STRICT tables require SQLite 3.37 or later')
+def test_create_table_strict():
+    with ContextManager(':memory:') as cursor:
+        db = Ts_Operator(cursor)
+        db.create_table('table1', ['word', 'rank'], [('a', 1)],
+                        col_types={'rank': 'INTEGER'}, strict=True)
+        with pytest.raises(sqlite3.IntegrityError):
+            db.insert_rows('table1', [('b', 'two')])
+        db._timestamp('table1', 1)
+        db.copy_table('table1', 'table2')
+        assert db._is_strict('table1') and db._is_strict('table2')
+        db.create_table('table3', ['word'])
+        assert not db._is_strict('table3')
+        assert db.get_col_types('table2') == ['TEXT', 'INTEGER']
+
+
 def test_insert_rows():
     with ContextManager(TESTDB_PATH, testing=True) as cursor:
         db = Operator(cursor)
@@ -435,6 +975,45 @@ def test_insert_rows_TS():
                 ('8', 'hiems, mis,f', 'hiver')]
 
 
+def test_insert_rows_streaming(tmp_path):
+    def rows(n):
+        for i in range(n):
+            yield (f'word{i}', f'mot{i}')
+        yield ('spes', 'ei f', 'espoir')
+
+    with ContextManager(tmp_path / 'test.db') as cursor:
+        db = Ts_Operator(cursor)
+        db.create_table('table1', ['col1', 'col2'])
+        db.insert_rows('table1', iter([]))
+        with pytest.raises(ValueError) as excinfo:
+            db.insert_rows('table1', rows(2500))
+        assert str(excinfo.value) == "In database, 'spes', 'ei f', 'espoir'"\
+            " requires 3 columns, but table table1 has only 2 columns."
+        assert db.get_rows_nb('table1') == 0
+        with pytest.raises(ValueError):
+            db.insert_rows('table1', rows(2500), commit_every=1000)
+        assert db.get_rows_nb('table1') == 2000
+        cursor.connection.rollback()
+        assert db.get_rows_nb('table1') == 2000
+        db.insert_rows('table1', ([f'w{i}', f'm{i}'] for i in range(10)))
+        assert db.get_table('table1')[-1] == ('2010', 'w9', 'm9')
+        cursor.connection.rollback()
+        assert db.get_rows_nb('table1') == 2000
+    with ContextManager(tmp_path / 'test.db', testing=True) as cursor:
+        db = Ts_Operator(cursor)
+        with pytest.raises(ValueError) as excinfo:
+            db.insert_rows('table1', rows(10), commit_every=5)
+        assert str(excinfo.value) == 'In database, cannot commit every 5 '\
+            'rows inside savepoint "starttest".'
+        with pytest.raises(ValueError):
+            db.import_table('table2', io.StringIO('col1\na\n'),
+                            commit_every=5)
+        assert not db.table_exists('table2')
+        db.insert_rows('table1', [('a', 'b')])
+    with ContextManager(tmp_path / 'test.db') as cursor:
+        assert Ts_Operator(cursor).get_rows_nb('table1') == 2000
+
+
 def test_merge_tables():
     with ContextManager(TESTDB_PATH, testing=True) as cursor:
         db = Operator(cursor)
@@ -503,6 +1082,14 @@ def test_remove_row():
             == [('1', 'adventus,  us, m.', 'arrivée'),
                 ('2', 'candidus,  a, um', 'blanc'),
                 ('3', 'sol, solis, m', 'soleil')]
+        db.remove_row('table1', db.get_table('table1')[1][0])
+        assert db.get_table('table1') \
+            == [('1', 'adventus,  us, m.', 'arrivée'),
+                ('2', 'sol, solis, m', 'soleil')]
+        with pytest.raises(ValueError) as excinfo:
+            db.remove_row('table1', 'a')
+        assert str(excinfo.value) == 'In database, cannot use "a" as an id '\
+            '(ids are integers).'
 
 
 def test_remove_rows():
@@ -517,6 +1104,59 @@ def test_remove_rows():
             == [('1', 'sol, solis, m', 'soleil')]
 
 
+def test_assert_ranges_exist():
+    with ContextManager(':memory:') as cursor:
+        db = Operator(cursor)
+        db.create_table('table1', ['col1'], [(str(n), ) for n in range(20)])
+        cursor.execute('DELETE FROM table1 WHERE id IN (1, 9, 10, 20);')
+        assert db._assert_ranges_exist('table1', [(2, 8), (11, 19)])
+        for ranges, missing in [([(1, 4)], 1), ([(2, 12)], 9),
+                                ([(2, 3), (18, 20)], 20)]:
+            with pytest.raises(ValueError) as excinfo:
+                db._assert_ranges_exist('table1', ranges)
+            assert str(excinfo.value) == f'In database, cannot find a row '\
+                f'number {missing} in table "table1"'
+
+
+def test_remove_rows_large_span():
+    with ContextManager(':memory:') as cursor:
+        db = Operator(cursor)
+        db.create_table('table1', ['col1'],
+                        [(str(n), ) for n in range(1, 5001)])
+        db.remove_rows('table1', '2-4000,4002,4004-4999')
+        assert db.get_table('table1') \
+            == [('1', '1'), ('2', '4001'), ('3', '4003'), ('4', '5000')]
+
+
+def test_reset_table_ids():
+    with ContextManager(':memory:') as cursor:
+        db = Operator(cursor)
+        db.create_table('table1', ['col1'], [(str(n), ) for n in range(12)])
+        cursor.execute('DELETE FROM table1 WHERE id IN (2, 5, 6, 7, 11);')
+        db._reset_table_ids('table1', removed=[(2, 2), (5, 7), (11, 11)])
+        assert db.get_table('table1') \
+            == [('1', '0'), ('2', '2'), ('3', '3'), ('4', '7'), ('5', '8'),
+                ('6', '9'), ('7', '11')]
+        cursor.execute('DELETE FROM table1 WHERE id IN (3, 6);')
+        db._reset_table_ids('table1')
+        assert db.get_table('table1') \
+            == [('1', '0'), ('2', '2'), ('3', '7'), ('4', '8'), ('5', '11')]
+        # A gap that existed before the removal is closed too
+        db.create_table('table2', ['col1'],
+                        [(str(n), ) for n in range(1, 11)])
+        cursor.execute('DELETE FROM table2 WHERE id = 3;')
+        db.remove_row('table2', 7)
+        assert db.get_table('table2') \
+            == [('1', '1'), ('2', '2'), ('3', '4'), ('4', '5'), ('5', '6'),
+                ('6', '8'), ('7', '9'), ('8', '10')]
+        # Ids starting from 2
+        cursor.execute('UPDATE table2 SET id = -id;')
+        cursor.execute('UPDATE table2 SET id = 1 - id;')
+        db.remove_rows('table2', '8-9')
+        assert [row[0] for row in db.get_table('table2')] \
+            == ['1', '2', '3', '4', '5', '6']
+
+
 def test_timestamp():
     with ContextManager(TESTDB_TS_PATH, testing=True) as cursor:
         db = Ts_Operator(cursor)
@@ -585,3 +1225,427 @@ def test_draw_rows():
         db._timestamp('table1', 3)
         result = db.draw_rows('table1', 2, oldest_prevail=True)
         assert ('sol, solis, m', 'soleil') in result
+
+
+def test_draw_rows_sampling():
+    with ContextManager(':memory:') as cursor:
+        db = Ts_Operator(cursor)
+        db.create_table('table1', ['col1'],
+                        [(str(n), ) for n in range(1, 101)])
+        result = db.draw_rows('table1', 100)
+        assert sorted(int(r[0]) for r in result) == list(range(1, 101))
+        assert db.draw_rows('table1', 0) == []
+        # Mostly free rows: random ids are tried
+        cursor.execute('UPDATE table1 SET timestamp=1 WHERE id % 10 = 0;')
+        result = db.draw_rows('table1', 5, oldest_prevail=True)
+        assert len(set(result)) == 5
+        assert all(int(r[0]) % 10 for r in result)
+        # Few free rows: they are all read
+        cursor.execute('UPDATE table1 SET timestamp=1 WHERE id % 10 != 7;')
+        result = db.draw_rows('table1', 10, oldest_prevail=True)
+        assert sorted(int(r[0]) for r in result) == list(range(7, 101, 10))
+        # Ids with gaps
+        cursor.execute('DELETE FROM table1 WHERE id > 3 AND id < 99;')
+        result = db.draw_rows('table1', 5)
+        assert sorted(int(r[0]) for r in result) == [1, 2, 3, 99, 100]
+        with pytest.raises(ValueError) as excinfo:
+            db.draw_rows('table1', 6)
+        assert str(excinfo.value) == '6 rows are required from "table1", '\
+            'but it only contains 5 rows.'
+
+
+def test_draw_rows_seed():
+    with ContextManager(':memory:') as cursor:
+        db = Ts_Operator(cursor)
+        db.create_table('table1', ['col1'],
+                        [(str(n), ) for n in range(1, 101)])
+        drawn = db.draw_rows('table1', 10, seed=42)
+        assert db.draw_rows('table1', 10, seed=42) == drawn
+        assert db.draw_rows('table1', 10, seed=43) != drawn
+        assert db.draw_rows('table1', 10, rng=random.Random(42)) == drawn
+        cursor.execute('UPDATE table1 SET timestamp=1 WHERE id % 10 != 7;')
+        drawn = db.draw_rows('table1', 3, oldest_prevail=True, seed=7)
+        assert db.draw_rows('table1', 3, oldest_prevail=True, seed=7) \
+            == drawn
+        assert all(r[0].endswith('7') for r in drawn)
+
+
+def test_draw_batches():
+    with ContextManager(':memory:') as cursor:
+        db = Ts_Operator(cursor)
+        db.create_table('table1', ['col1'],
+                        [(str(n), ) for n in range(1, 21)])
+        batches = db.draw_batches('table1', 3, 5, seed=1)
+        assert len(batches) == 5
+        assert all(len(set(b)) == 3 for b in batches)
+        assert db.draw_batches('table1', 3, 5, seed=1) == batches
+        cursor.execute('UPDATE table1 SET timestamp=1 WHERE id > 4;')
+        batches = db.draw_batches('table1', 4, 3, oldest_prevail=True)
+        assert all(sorted(b) == [('1', ), ('2', ), ('3', ), ('4', )]
+                   for b in batches)
+        cursor.execute('DELETE FROM table1 WHERE id > 2 AND id < 19;')
+        batches = db.draw_batches('table1', 4, 2)
+        assert all(sorted(b) == [('1', ), ('19', ), ('2', ), ('20', )]
+                   for b in batches)
+        with pytest.raises(ValueError) as excinfo:
+            db.draw_batches('table1', 5, 2)
+        assert str(excinfo.value) == '5 rows are required from "table1", '\
+            'but it only contains 4 rows.'
+
+
+def test_draw_and_mark():
+    with ContextManager(TESTDB_TS_PATH, testing=True) as cursor:
+        db = Ts_Operator(cursor)
+        statements = []
+        cursor.connection.set_trace_callback(statements.append)
+        db.draw_and_mark('table1', 1, seed=3)
+        n = len(statements)
+        db._full_reset('table1')
+        statements.clear()
+        result = db.draw_and_mark('table1', 3, seed=3)
+        cursor.connection.set_trace_callback(None)
+        assert len(statements) <= n
+        stamped = cursor.execute('SELECT col1, col2 FROM table1 '
+                                 'WHERE timestamp != 0;').fetchall()
+        assert sorted(result) == sorted(stamped)
+        result = db.draw_and_mark('table1', 2)
+        assert len(set(result) & set(stamped)) == 1
+        with pytest.raises(ValueError) as excinfo:
+            db.draw_and_mark('table1', 5)
+        assert str(excinfo.value) == '5 rows are required from "table1", '\
+            'but it only contains 4 rows.'
+        assert len(cursor.execute('SELECT id FROM table1 '
+                                  'WHERE timestamp != 0;').fetchall()) == 4
+
+
+def test_int_timestamps():
+    with ContextManager(TESTDB_TS_PATH, testing=True) as cursor:
+        db = Ts_Operator(cursor)
+        db._timestamp('table1', 2)
+        db._timestamp('table1', 4)
+        db = Ts_Operator(cursor, int_timestamps=True)
+        db.migrate_timestamps('table1')
+        timestamps = cursor.execute('SELECT timestamp FROM table1 '
+                                    'ORDER BY id;').fetchall()
+        assert [type(t[0]) for t in timestamps] == [int] * 4
+        assert timestamps[0][0] == timestamps[2][0] == 0
+        assert 0 < timestamps[1][0] <= timestamps[3][0]
+        assert abs(timestamps[3][0] - time.time() * 1000000) < 60000000
+        db._timestamp('table1', 1)
+        assert cursor.execute('SELECT timestamp FROM table1 WHERE id=1;')\
+            .fetchone()[0] >= timestamps[3][0]
+        db._reset('table1', 1)
+        stamped = cursor.execute('SELECT id FROM table1 WHERE timestamp != 0 '
+                                 'ORDER BY id;').fetchall()
+        assert stamped == [(1, ), (4, )]
+        # The format is the table's, whatever the Ts_Operator
+        db = Ts_Operator(cursor)
+        db._timestamp('table1', 3)
+        db._timestamp_ids('table1', [2])
+        assert [type(t[0]) for t in cursor.execute(
+            'SELECT timestamp FROM table1 WHERE id IN (2, 3);')] == [int] * 2
+        db._reset('table1', 1)
+        stamped = cursor.execute('SELECT id FROM table1 WHERE timestamp != 0 '
+                                 'ORDER BY id;').fetchall()
+        assert stamped == [(1, ), (2, ), (3, )]
+        db.copy_table('table1', 'table4')
+        assert db._has_int_timestamps('table4')
+        db = Ts_Operator(cursor, int_timestamps=True)
+        db.create_table('table3', ['col1'], [('a', ), ('b', )])
+        db.sort_table('table3', 1)
+        db.sort_table('table3', 1)
+        assert sorted(db.list_indexes('table3')) \
+            == ['table3_free_idx', 'table3_timestamp_idx']
+        db.rename_table('table3', 'table6')
+        assert db._has_int_timestamps('table6')
+        assert not db._has_int_timestamps('table3')
+        db.remove_table('table6')
+        assert not db._has_int_timestamps('table6')
+        # The format does not depend on the indexes
+        db.create_table('table7', ['col1'], [('a', ), ('b', )], strict=True)
+        db.drop_index('table7_free_idx')
+        db._timestamp('table7', 1)
+        db.copy_table('table7', 'table8', indexes=False)
+        assert db.draw_and_mark('table8', 1) == [('b', )]
+        db = Ts_Operator(cursor)
+        db.create_table('table9', ['col1'], [('a', )])
+        db.create_index('table9', ['timestamp'])
+        db.create_index('table9', ['id'], name='table9_free_idx',
+                        where='timestamp=0')
+        db._timestamp('table9', 1)
+        assert cursor.execute('SELECT typeof(timestamp) FROM table9;')\
+            .fetchone()[0] == 'text'
+
+
+def test_generations():
+    with ContextManager(TESTDB_TS_PATH, testing=True) as cursor:
+        db = Ts_Operator(cursor, generations=True)
+        db.create_table('table3', ['col1'], [('a', ), ('b', ), ('c', )])
+        assert db.get_cols('table3') == ['col1']
+        assert db.list_tables() == ['table1', 'table2', 'table3']
+        db._timestamp('table3', 1)
+        db._timestamp('table3', 3)
+        assert db.draw_rows('table3', 1, oldest_prevail=True) == [('b', )]
+        db._reset('table3', 1)
+        assert sorted(db.draw_rows('table3', 2, oldest_prevail=True)) \
+            == [('a', ), ('b', )]
+        db._timestamp('table3', 1)
+        db._timestamp('table3', 2)
+        statements = []
+        cursor.connection.set_trace_callback(statements.append)
+        db._full_reset('table3')
+        cursor.connection.set_trace_callback(None)
+        assert not any(s.startswith('UPDATE table3') for s in statements)
+        assert db._generation('table3') == 2
+        assert len(db.draw_rows('table3', 3, oldest_prevail=True)) == 3
+        assert db.draw_and_mark('table3', 2, seed=1) \
+            == db.draw_rows('table3', 2, seed=1)
+        db.sort_table('table3', 1)
+        assert db._generation('table3') == 2
+        assert len(db.draw_rows('table3', 1, oldest_prevail=True)) == 1
+        db.remove_table('table3')
+        assert db._generation('table3') == 1
+        # Existing table
+        db._timestamp('table1', 4)
+        db.enable_generations('table1')
+        assert db.get_cols('table1') == ['col1', 'col2']
+        assert db.get_table('table1')[3] == ('4', 'sol, solis, m', 'soleil')
+        assert ('sol, solis, m', 'soleil') \
+            not in db.draw_rows('table1', 3, oldest_prevail=True)
+
+
+def check_counters(db, table_name):
+    counters = db._counters(table_name)
+    cmd = f'SELECT COUNT(*), (SELECT COUNT(*) FROM {table_name} WHERE '\
+        f'{db._free_clause(table_name)}) FROM {table_name};'
+    assert counters == db.cursor.execute(cmd).fetchone()
+    return counters
+
+
+def test_counters():
+    with ContextManager(TESTDB_PATH, testing=True) as cursor:
+        db = Operator(cursor, counters=True)
+        db.create_table('table3', ['col1'], [('a', ), ('b', ), ('c', )])
+        assert check_counters(db, 'table3') == (3, 3)
+        statements = []
+        cursor.connection.set_trace_callback(statements.append)
+        assert db.get_rows_nb('table3') == 3
+        cursor.connection.set_trace_callback(None)
+        assert not any('COUNT' in s for s in statements)
+        db.insert_rows('table3', [('d', ), ('e', )])
+        db.remove_row('table3', 1)
+        db.remove_rows('table3', '2-3')
+        assert db.get_rows_nb('table3') == 2
+        db.rename_table('table3', 'table4')
+        db.insert_rows('table4', [('f', )])
+        assert check_counters(db, 'table4') == (3, 3)
+        db.sort_table('table4', 1)
+        db.copy_table('table4', 'table5')
+        db._reset_table_ids('table4')
+        db.remove_row('table5', 1)
+        assert check_counters(db, 'table4') == (3, 3)
+        assert check_counters(db, 'table5') == (2, 2)
+        db.remove_table('table4')
+        assert db._counters('table4') is None
+        assert db._counters('table1') is None
+        db.enable_counters('table1')
+        assert check_counters(db, 'table1') == (4, 4)
+        db.disable_counters('table1')
+        db.remove_row('table1', 1)
+        assert db._counters('table1') is None
+        assert db.get_rows_nb('table1') == 3
+
+
+@pytest.mark.parametrize('int_timestamps,generations',
+                         [(False, False), (True, False), (True, True)])
+def test_ts_counters(int_timestamps, generations):
+    with ContextManager(TESTDB_TS_PATH, testing=True) as cursor:
+        db = Ts_Operator(cursor, int_timestamps=int_timestamps,
+                         generations=generations, counters=True)
+        db.create_table('table3', ['col1'],
+                        [(str(i), ) for i in range(10)])
+        assert check_counters(db, 'table3') == (10, 10)
+        db.draw_and_mark('table3', 4, seed=1)
+        assert check_counters(db, 'table3') == (10, 6)
+        db.draw_and_mark('table3', 8, seed=2)
+        assert check_counters(db, 'table3')[0] == 10
+        db._full_reset('table3')
+        assert check_counters(db, 'table3') == (10, 10)
+        db.draw_and_mark('table3', 3, seed=3)
+        db.remove_rows('table3', '1-4')
+        db.sort_table('table3', 1)
+        db.rename_table('table3', 'table4')
+        db.copy_table('table4', 'table5')
+        db._timestamp('table5', 1)
+        for name in ('table4', 'table5'):
+            assert check_counters(db, name)[0] == 6
+        db.enable_counters('table1')
+        db._timestamp('table1', 2)
+        assert check_counters(db, 'table1') == (4, 3)
+        if generations:
+            db.enable_generations('table1')
+            assert check_counters(db, 'table1') == (4, 3)
+            db._full_reset('table1')
+            assert check_counters(db, 'table1') == (4, 4)
+
+
+def test_async_operators():
+    async def main():
+        async with AsyncContextManager(TESTDB_TS_PATH, testing=True) \
+                as cursor:
+            db = AsyncTsOperator(cursor)
+            assert await db.get_rows_nb('table1') == 4
+            draws = await asyncio.gather(*[db.draw_rows('table2', 2, seed=1)
+                                           for _ in range(20)])
+            assert all(rows == draws[0] for rows in draws)
+            await db.insert_rows('table2', [('a', 'b', 'c')])
+            assert await db.get_rows_nb('table2') == 5
+            rows = [row async for row in await db.iter_table('table2',
+                                                             batch_size=2)]
+            assert rows == await db.get_table('table2')
+            with pytest.raises(ValueError) as excinfo:
+                await db.get_table('table9')
+            assert str(excinfo.value) == 'In database, cannot find a table '\
+                'named "table9"'
+            assert isinstance(AsyncOperator(cursor).operator, Operator)
+
+    asyncio.run(main())
+
+
+def test_async_cancellation():
+    async def main():
+        async with AsyncContextManager(TESTDB_PATH, testing=True) as cursor:
+            done = []
+            first = asyncio.ensure_future(cursor.run(time.sleep, 0.1))
+            queued = asyncio.ensure_future(cursor.run(done.append, 1))
+            await asyncio.sleep(0.01)
+            queued.cancel()
+            await first
+            await cursor.run(done.append, 2)
+            assert done == [2]
+            cmd = 'WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 '\
+                'FROM c) SELECT COUNT(*) FROM c;'
+            endless = asyncio.ensure_future(
+                cursor.run(lambda: cursor.cursor.execute(cmd).fetchone()))
+            await asyncio.sleep(0.05)
+            endless.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await endless
+            db = AsyncOperator(cursor)
+            assert await db.get_rows_nb('table1') == 4
+            with pytest.raises(AttributeError) as excinfo:
+                db.table('table1')
+            assert str(excinfo.value) == 'In database, AsyncOperator cannot '\
+                'provide table(), that needs the connection\'s thread.'
+
+    asyncio.run(main())
+
+
+def test_write_queue(tmp_path):
+    path = tmp_path / 'test.db'
+    shutil.copy(TESTDB_TS_PATH, path)
+    with WriteQueue(path, operator_class=Ts_Operator, max_batch=50,
+                    max_delay=0.05, int_timestamps=True) as writer:
+        def write(i):
+            return [writer.insert_rows('table2', [(f'w{i}', 'x', 'y')]),
+                    writer._timestamp('table1', 1 + i % 4)]
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            futures = sum(executor.map(write, range(100)), [])
+        failing = writer.remove_row('table1', 9)
+        updated = writer.update_table('table2', 1, ['a', 'b', 'c'])
+        assert updated.result() is None
+        with pytest.raises(ValueError) as excinfo:
+            failing.result()
+        assert str(excinfo.value) == 'In database, cannot find a row '\
+            'number 9 in table "table1"'
+        assert all(future.result() is None for future in futures)
+        assert writer.batches < writer.calls == 202
+        with pytest.raises(AttributeError):
+            writer.unknown_method
+    with ContextManager(path) as cursor:
+        db = Operator(cursor)
+        assert db.get_rows_nb('table2') == 104
+        assert db.get_table('table2')[0] == ('1', 'a', 'b', 'c', 0)
+        # table1 keeps its text timestamps, despite int_timestamps=True
+        assert all(isinstance(row[-1], str) for row in db.get_table('table1'))
+    with pytest.raises(ValueError) as excinfo:
+        writer.remove_row('table1', 1)
+    assert str(excinfo.value) == 'In database, cannot queue a call to a '\
+        'WriteQueue that is not started.'
+    with WriteQueue(path, operator_class=Ts_Operator, max_delay=0.5) \
+            as writer:
+        start = time.monotonic()
+        writer.insert_rows('table2', [('a', 'b', 'c')]).result()
+        assert time.monotonic() - start < 0.25
+        # The calls wait for the lock, and the second one is cancelled
+        thread = lock_database(path, 0.2)
+        first = writer.insert_rows('table2', [('d', 'e', 'f')])
+        assert writer.insert_rows('table2', [('g', 'h', 'i')]).cancel()
+        assert first.result() is None
+        thread.join()
+    assert writer.calls == 2
+
+
+def lock_database(path, duration):
+    """Keep a write lock on the database for duration seconds."""
+    locked = threading.Event()
+
+    def lock():
+        with closing(sqlite3.connect(str(path), isolation_level=None)) \
+                as conn:
+            conn.execute('BEGIN IMMEDIATE;')
+            locked.set()
+            time.sleep(duration)
+            conn.execute('COMMIT;')
+
+    thread = threading.Thread(target=lock)
+    thread.start()
+    locked.wait()
+    return thread
+
+
+def test_retry_policy(tmp_path):
+    policy = RetryPolicy(base_delay=0.1, max_delay=0.3, jitter=0.5, seed=1)
+    assert 0.05 <= policy.delay(1) <= 0.1
+    assert 0.1 <= policy.delay(2) <= 0.2
+    assert 0.15 <= policy.delay(5) <= 0.3
+    path = tmp_path / 'test.db'
+    shutil.copy(TESTDB_PATH, path)
+    policy = RetryPolicy(attempts=20, base_delay=0.02, busy_timeout=0)
+    thread = lock_database(path, 0.2)
+    with ContextManager(path, retry=policy, immediate=True) as cursor:
+        assert cursor.connection.in_transaction
+        Operator(cursor).insert_rows('table1', [('a', 'b')])
+    thread.join()
+    assert policy.metrics['retries'] > 0
+    assert policy.metrics['wait_time'] > 0
+    assert policy.metrics['failures'] == 0
+    retries = policy.metrics['retries']
+    thread = lock_database(path, 0.2)
+    with ContextManager(path, retry=policy) as cursor:
+        db = Operator(cursor)
+        db.drop_table('table2')
+        assert db.list_tables() == ['table1']
+    thread.join()
+    assert policy.metrics['retries'] > retries
+    retries = policy.metrics['retries']
+    thread = lock_database(path, 0.2)
+    with ContextManager(path, retry=policy) as cursor:
+        db = Operator(cursor)
+        db.insert_rows('table1', [('c', 'd')])
+        db.update_table('table1', 1, ['e', 'f'])
+    thread.join()
+    assert policy.metrics['retries'] > retries
+    assert policy.metrics['failures'] == 0
+    policy = RetryPolicy(attempts=2, base_delay=0.01, busy_timeout=0)
+    thread = lock_database(path, 0.2)
+    with pytest.raises(sqlite3.OperationalError) as excinfo:
+        with ContextManager(path, retry=policy, immediate=True):
+            pass
+    thread.join()
+    assert str(excinfo.value) == 'database is locked'
+    assert policy.metrics['lock_errors'] == 2
+    assert policy.metrics['failures'] == 1
+    with ContextManager(path) as cursor:
+        assert Operator(cursor).get_rows_nb('table1') == 6
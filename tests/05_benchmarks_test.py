@@ -0,0 +1,44 @@
+# Microlib is a small collection of useful tools.
+# Copyright 2020 Nicolas Hainaux <nh.techn@gmail.com>
+
+# This file is part of Microlib.
+
+# Microlib is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# any later version.
+
+# Microlib is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Microlib; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+from benchmarks.database_bench import BENCHMARKS, run, compare, main
+from benchmarks.database_bench import comparison_to_text
+
+
+def test_run():
+    results = run(sizes=[50], repeat=1, memory=True)
+    assert set(results['timings']) == set(BENCHMARKS)
+    assert all(timings['50'] > 0 for timings in results['timings'].values())
+    assert results['meta']['repeat'] == 1
+
+
+def test_compare(tmp_path):
+    results = {'timings': {'get_table': {'50': 0.375, '100': 0.5},
+                           'sort_table': {'50': 0.1}}}
+    baseline = {'timings': {'get_table': {'50': 0.25, '100': 0.5}}}
+    assert compare(results, baseline) \
+        == [('get_table', '50', 0.25, 0.375, 1.5, True),
+            ('get_table', '100', 0.5, 0.5, 1.0, False)]
+    assert 'REGRESSED' in comparison_to_text(compare(results, baseline))
+    output = tmp_path / 'results.json'
+    assert main(['--sizes', '20', '--repeat', '1', '--memory',
+                 '--only', 'draw_rows', '--output', str(output)]) == 0
+    assert main(['--sizes', '20', '--repeat', '1', '--memory',
+                 '--only', 'draw_rows', '--compare', str(output),
+                 '--tolerance', '1000']) == 0